@@ -0,0 +1,9 @@
+import sys
+
+from Qt import QtCore
+
+from file_manager.thumbnails import backfill_variants
+
+# Image format plugins are found through the application instance
+app = QtCore.QCoreApplication(sys.argv)
+backfill_variants(overwrite='--overwrite' in sys.argv)
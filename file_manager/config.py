@@ -1,6 +1,7 @@
 import ConfigParser
 import glob
 import logging
+import multiprocessing
 import os
 from collections import defaultdict
 
@@ -19,6 +20,14 @@ class _Settings(object):
 
         self.main_ui = None
         self.thumb_size = 100  # percent
+        self.viewer_page_size = 200
+        self.thumbnail_cache_mb = 256
+        self.preview_cache_mb = 128
+        self.scan_workers = 8
+        self.snapshot_folder = os.path.join(os.path.expanduser('~'), '.file_manager', 'snapshots')
+        self.import_batch_size = 1000
+        self.template_processes = multiprocessing.cpu_count()
+        self.template_timeout = 600
         self._thumbnail_folder = None
         self._app_icons_win = None
 
@@ -29,6 +38,22 @@ class _Settings(object):
         self.db_user = None
         self.db_pass = None
 
+        self.db_pool_min_size = 1
+        self.db_pool_max_size = 10
+        self.db_pool_idle_timeout = 300
+        self.db_pool_wait_timeout = 30
+        self.db_bulk_batch_size = 5000
+        self.db_stream_batch_size = 2000
+
+        self.identity_map_ttl = 60  # seconds, None keeps records until invalidated
+        self.identity_map_size = 100000
+
+        self.sqlite_journal_mode = 'DELETE'  # WAL is unsafe on network shares, opt in for local files only
+        self.sqlite_synchronous = 'FULL'
+        self.sqlite_cache_size = -64000  # negative values are KiB
+        self.sqlite_mmap_size = 268435456
+        self.sqlite_temp_store = 'MEMORY'
+
         self._load_settings()
 
     @property
@@ -67,6 +92,14 @@ class _Settings(object):
 
         self._thumbnail_folder = config.get('settings', 'thumbnail_folder')
         self._app_icons_win = config.get('settings', 'app_icons_win')
+        self.viewer_page_size = self._get_int(config, 'settings', 'viewer_page_size', self.viewer_page_size)
+        self.thumbnail_cache_mb = self._get_int(config, 'settings', 'thumbnail_cache_mb', self.thumbnail_cache_mb)
+        self.preview_cache_mb = self._get_int(config, 'settings', 'preview_cache_mb', self.preview_cache_mb)
+        self.scan_workers = self._get_int(config, 'settings', 'scan_workers', self.scan_workers)
+        self.snapshot_folder = self._get(config, 'settings', 'snapshot_folder', self.snapshot_folder)
+        self.import_batch_size = self._get_int(config, 'settings', 'import_batch_size', self.import_batch_size)
+        self.template_processes = self._get_int(config, 'settings', 'template_processes', self.template_processes)
+        self.template_timeout = self._get_int(config, 'settings', 'template_timeout', self.template_timeout)
 
         self.db_engine = config.get('database', 'engine')
         self.db_name = config.get('database', 'name')
@@ -75,10 +108,37 @@ class _Settings(object):
         self.db_user = config.get('database', 'user')
         self.db_pass = config.get('database', 'pass')
 
+        self.db_pool_min_size = self._get_int(config, 'database', 'pool_min_size', self.db_pool_min_size)
+        self.db_pool_max_size = self._get_int(config, 'database', 'pool_max_size', self.db_pool_max_size)
+        self.db_pool_idle_timeout = self._get_int(config, 'database', 'pool_idle_timeout', self.db_pool_idle_timeout)
+        self.db_pool_wait_timeout = self._get_int(config, 'database', 'pool_wait_timeout', self.db_pool_wait_timeout)
+        self.db_bulk_batch_size = self._get_int(config, 'database', 'bulk_batch_size', self.db_bulk_batch_size)
+        self.db_stream_batch_size = self._get_int(config, 'database', 'stream_batch_size', self.db_stream_batch_size)
+
+        _ttl = float(self._get(config, 'database', 'identity_map_ttl', self.identity_map_ttl))
+        self.identity_map_ttl = _ttl or None
+        self.identity_map_size = self._get_int(config, 'database', 'identity_map_size', self.identity_map_size)
+
+        self.sqlite_journal_mode = self._get(config, 'sqlite', 'journal_mode', self.sqlite_journal_mode)
+        self.sqlite_synchronous = self._get(config, 'sqlite', 'synchronous', self.sqlite_synchronous)
+        self.sqlite_cache_size = self._get_int(config, 'sqlite', 'cache_size', self.sqlite_cache_size)
+        self.sqlite_mmap_size = self._get_int(config, 'sqlite', 'mmap_size', self.sqlite_mmap_size)
+        self.sqlite_temp_store = self._get(config, 'sqlite', 'temp_store', self.sqlite_temp_store)
+
         # Create directory
         if os.name == 'nt' and self._thumbnail_folder and not os.path.isdir(self._thumbnail_folder):
             os.makedirs(self._thumbnail_folder)
 
+    @staticmethod
+    def _get(config, section, option, default):
+        if not config.has_option(section, option):
+            return default
+        return config.get(section, option) or default
+
+    @staticmethod
+    def _get_int(config, section, option, default):
+        return int(_Settings._get(config, section, option, default))
+
 
 settings = _Settings()
 """:type: _Settings"""
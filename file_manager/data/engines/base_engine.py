@@ -1,8 +1,32 @@
+import copy
+import numbers
+
+from ..identity_map import IDENTITY_MAP
+from ..query import Query
+
+
 class BaseEngine(object):
     @classmethod
     def setup_entity(cls, entity_class):
         raise NotImplementedError()
 
+    @classmethod
+    def transaction(cls):
+        """
+        Context manager running every write of the calling thread inside one transaction, committed when the block
+        exits and rolled back if it raises. Nested blocks join the outer transaction. The identity map is cleared
+        on rollback as records updated inside the block may hold values that were never committed.
+
+        Usage::
+
+            with engine.transaction():
+                engine.create_many(assets)
+                engine.create_many(paths)
+
+        :rtype: contextlib.GeneratorContextManager
+        """
+        raise NotImplementedError()
+
     @classmethod
     def create(cls, entity):
         raise NotImplementedError()
@@ -11,8 +35,118 @@ class BaseEngine(object):
     def create_many(cls, entities):
         raise NotImplementedError()
 
+    @classmethod
+    def bulk_load(cls, entities, batch_size=None):
+        raise NotImplementedError()
+
+    @classmethod
+    def create_missing(cls, entities, column):
+        """
+        Insert the entities whose value of a unique column is not in the table yet, rows that exist already, or are
+        inserted meanwhile by another session, are left as they are. No ids are applied, select the rows afterwards.
+
+        :type entities: list[file_manager.data.base_entity.BaseEntity]
+        :type column: str
+        :param column: Column with a unique index identifying the rows
+        """
+        raise NotImplementedError()
+
     @classmethod
     def select(cls, query):
+        """
+        Records already in the identity map are returned without a round trip when the query only
+        filters on id, every other query is run and its results merged into the map.
+
+        :type query: file_manager.data.query.Query
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        """
+        ids = query.id_lookup()
+        if ids is None or not all(isinstance(i, numbers.Integral) for i in ids):
+            return IDENTITY_MAP.merge(cls._fetch(query))
+
+        found, missing = IDENTITY_MAP.get_many(query.table(), ids)
+        if missing:
+            for entity in IDENTITY_MAP.merge(cls._fetch(Query(query.table(), id=missing))):
+                found[entity.id] = entity
+        return [found[i] for i in sorted(found)]
+
+    @classmethod
+    def _fetch(cls, query):
+        """
+        Run the query against the database, bypassing the identity map.
+
+        :type query: file_manager.data.query.Query
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def select_page(cls, query, page_size, order_by='name', after=None):
+        """
+        Fetch one page of records using keyset pagination, which stays fast however deep the page is.
+
+        :type query: file_manager.data.query.Query
+        :param query: Filters to page through, it is not modified
+        :type page_size: int
+        :type order_by: str
+        :param order_by: Column to page by, ties are broken by id
+        :type after: (variant, int) or None
+        :param after: Cursor returned with the previous page, None for the first page
+        :rtype: (list[file_manager.data.base_entity.BaseEntity], (variant, int) or None)
+        :return: Records of the page and the cursor of the next page, None once the last page is reached
+        """
+        page_query = copy.deepcopy(query)
+        page_query.seek_after(order_by, after).set_limit(page_size)
+
+        records = cls.select(page_query)
+        if len(records) < page_size:
+            return records, None
+
+        last = records[-1]
+        return records, (getattr(last, order_by), last.id)
+
+    @classmethod
+    def iter_select(cls, query, batch_size=None):
+        """
+        Yield the records matching the query without loading them all at once. Streamed records
+        are not added to the identity map.
+
+        :type query: file_manager.data.query.Query
+        :type batch_size: int
+        :param batch_size: Rows fetched per round trip, defaults to stream_batch_size in settings.ini
+        :rtype: collections.Iterator[file_manager.data.base_entity.BaseEntity]
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def select_pairs(cls, table, columns, pairs):
+        """
+        Find the records whose two columns match any of the given value pairs.
+
+        :type table: str
+        :type columns: (str, str)
+        :type pairs: collections.Iterable[tuple]
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def count_references(cls, table, key_column, count_column, ref_table, ref_column, expression):
+        """
+        Read a stored reference count of every row next to the number of rows of another table pointing at it, in
+        one statement so both are taken at the same moment.
+
+        :type table: str
+        :type key_column: str
+        :type count_column: str
+        :type ref_table: str
+        :type ref_column: str
+        :param ref_column: Column of ref_table holding the references
+        :type expression: str
+        :param expression: SQL over the columns of table giving the value ref_column holds, valid for every engine
+        :rtype: list[(variant, int, int)]
+        :return: Value of key_column, stored count and counted references of every row
+        """
         raise NotImplementedError()
 
     @classmethod
@@ -23,6 +157,24 @@ class BaseEngine(object):
     def update_many(cls, entities):
         raise NotImplementedError()
 
+    @classmethod
+    def increment(cls, table, column, key_column, amounts, minimum=None):
+        """
+        Add to a numeric column within the UPDATE statement, so sessions changing the same rows at once never
+        overwrite each other with a value they read earlier. Cached records keep the previous value, select the
+        rows again to read the new one.
+
+        :type table: str
+        :type column: str
+        :type key_column: str
+        :param key_column: Column identifying the rows to change
+        :type amounts: dict[variant,int]
+        :param amounts: Amount added to the rows by value of key_column, negative to subtract, a null counts as 0
+        :type minimum: int or None
+        :param minimum: The column never goes below this value
+        """
+        raise NotImplementedError()
+
     @classmethod
     def delete(cls, entity):
         raise NotImplementedError()
@@ -30,3 +182,43 @@ class BaseEngine(object):
     @classmethod
     def delete_many(cls, entities):
         raise NotImplementedError()
+
+    @classmethod
+    def delete_if(cls, entities, column, value):
+        """
+        Delete the entities whose column still holds value, checked by the DELETE itself so a row another session
+        changed meanwhile is kept.
+
+        :type entities: list[file_manager.data.base_entity.BaseEntity]
+        :type column: str
+        :type value: variant
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        :return: The entities deleted
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _index_definitions(entity_class):
+        """
+        :type entity_class: Type[file_manager.data.base_entity.BaseEntity]
+        :rtype: list[(str, tuple[str], bool)]
+        :return: Name, columns and uniqueness of every index declared on the entity
+        """
+        indexes = list()
+        for field in entity_class.fields():
+            if field.index and field.name != 'id':
+                indexes.append(((field.name,), field.unique))
+        for columns in entity_class.UNIQUE_TOGETHER:
+            indexes.append((tuple(columns), True))
+
+        result = list()
+        for columns, unique in indexes:
+            name = '%s_%s_%s' % ('uidx' if unique else 'idx', entity_class.NAME, '_'.join(columns))
+            result.append((name, columns, unique))
+        return result
+
+    @staticmethod
+    def _index_statement(entity_class, name, columns, unique):
+        return 'CREATE %sINDEX IF NOT EXISTS "%s" ON "%s" (%s);' % ('UNIQUE ' if unique else '', name,
+                                                                   entity_class.NAME,
+                                                                   ', '.join('"%s"' % c for c in columns))
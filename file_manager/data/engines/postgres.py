@@ -1,4 +1,8 @@
+import contextlib
 import datetime
+import itertools
+import threading
+import uuid
 from operator import attrgetter
 
 import psycopg2
@@ -7,9 +11,15 @@ import psycopg2.extras
 from .base_engine import BaseEngine
 from ..entities import find_entity
 from ..field import Field
+from ..identity_map import IDENTITY_MAP
+from ..pool import ConnectionPool
 from ..query import Query
 from ...config import settings, VERSION, LOG
 
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
 
 class PsycoPGEngine(BaseEngine):
     @classmethod
@@ -20,27 +30,67 @@ class PsycoPGEngine(BaseEngine):
         assert entity_class.NAME is not None, 'Entity %s does not have a NAME.' % entity_class
 
         conn = PsycoPGEngine._connect()
-        cursor = conn.cursor()
         try:
-            cursor.execute('CREATE TABLE "%s" (id SERIAL PRIMARY KEY NOT NULL);' % entity_class.NAME)
-        except psycopg2.ProgrammingError as e:
-            if 'already exists' in str(e):
-                LOG.debug('Table %s already exists.' % entity_class.NAME)
-            else:
-                raise
-
-        for field in entity_class.fields():
-            if not isinstance(field, Field) or field.name == 'id':
-                continue
+            cursor = conn.cursor()
             try:
-                cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (entity_class.NAME, field.name,
-                                                                         PsycoPGEngine._map_type(field.type)))
+                cursor.execute('CREATE TABLE "%s" (id SERIAL PRIMARY KEY NOT NULL);' % entity_class.NAME)
             except psycopg2.ProgrammingError as e:
                 if 'already exists' in str(e):
-                    LOG.debug('Column %s.%s already exists.' % (entity_class.NAME, field.name))
+                    LOG.debug('Table %s already exists.' % entity_class.NAME)
                 else:
                     raise
 
+            for field in entity_class.fields():
+                if not isinstance(field, Field) or field.name == 'id':
+                    continue
+                try:
+                    cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (entity_class.NAME, field.name,
+                                                                             PsycoPGEngine._map_type(field.type)))
+                except psycopg2.ProgrammingError as e:
+                    if 'already exists' in str(e):
+                        LOG.debug('Column %s.%s already exists.' % (entity_class.NAME, field.name))
+                    else:
+                        raise
+
+            for name, columns, unique in PsycoPGEngine._index_definitions(entity_class):
+                try:
+                    cursor.execute(PsycoPGEngine._index_statement(entity_class, name, columns, unique))
+                except psycopg2.IntegrityError as e:
+                    LOG.warning('Could not create unique index %s, existing rows are not unique: %s' % (name, e))
+        finally:
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    @contextlib.contextmanager
+    def transaction(cls):
+        """
+        Pins a pooled connection to the calling thread with autocommit off, every write made by the engine inside
+        the block goes through it. iter_select still borrows its own connection and only sees committed rows.
+
+        :rtype: contextlib.GeneratorContextManager
+        """
+        if getattr(_LOCAL, 'conn', None) is not None:
+            yield
+            return
+
+        conn = PsycoPGEngine._pool().acquire()
+        try:
+            conn.autocommit = False
+            _LOCAL.conn = conn
+            try:
+                yield
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                IDENTITY_MAP.clear()
+                raise
+        finally:
+            _LOCAL.conn = None
+            if not conn.closed:
+                conn.autocommit = True
+            PsycoPGEngine._release(conn)
+
     @classmethod
     def create(cls, entity):
         """
@@ -73,13 +123,20 @@ class PsycoPGEngine(BaseEngine):
                 setattr(entity, k, v)
             entity.clear_changes()
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
         return entity
 
     @classmethod
     def create_many(cls, entities):
+        if not entities:
+            return
+
         assert all(x.id is None for x in entities), 'Some entities already exist.'
 
+        if len(entities) > settings.db_bulk_batch_size:
+            cls.bulk_load(entities)
+            return
+
         entity_name = entities[0].NAME
         columns = [field.name for field in entities[0].fields() if field.name != 'id']
 
@@ -99,7 +156,7 @@ class PsycoPGEngine(BaseEngine):
         conn = PsycoPGEngine._connect()
         try:
             cursor = conn.cursor()
-            LOG.debug(cursor.mogrify(statement, all_values))
+            LOG.debug('INSERT INTO %s(%s) - %d records.' % (entity_name, ', '.join(columns), len(entities)))
             cursor.execute(statement, all_values)
             new_records = cursor.fetchall()
 
@@ -109,27 +166,226 @@ class PsycoPGEngine(BaseEngine):
                     setattr(entity, k, v)
                 entity.clear_changes()
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def bulk_load(cls, entities, batch_size=None):
+        """
+        Stream entities through COPY into a temporary staging table and insert them from there,
+        one transaction per batch so memory use does not grow with the number of entities.
+
+        :type entities: collections.Iterable[file_manager.data.base_entity.BaseEntity]
+        :param entities: Entities of a single type, may be a generator
+        :type batch_size: int
+        :param batch_size: Number of entities per batch, defaults to bulk_batch_size in settings.ini
+        """
+        batch_size = batch_size or settings.db_bulk_batch_size
+        entities = iter(entities)
+
+        # Inside transaction() the batches are committed, or rolled back, with the rest of the block
+        standalone = getattr(_LOCAL, 'conn', None) is None
+        conn = PsycoPGEngine._connect()
+        try:
+            if standalone:
+                conn.autocommit = False
+            cursor = conn.cursor()
+            while True:
+                batch = list(itertools.islice(entities, batch_size))
+                if not batch:
+                    break
+                try:
+                    PsycoPGEngine._copy_batch(cursor, batch)
+                    if standalone:
+                        conn.commit()
+                except:
+                    if standalone:
+                        conn.rollback()
+                    for entity in batch:
+                        entity.id = None
+                    raise
+                for entity in batch:
+                    entity.clear_changes()
+        finally:
+            if standalone:
+                conn.autocommit = True
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def create_missing(cls, entities, column):
+        """
+        :type entities: list[file_manager.data.base_entity.BaseEntity]
+        :type column: str
+        """
+        if not entities:
+            return
+
+        entity_name = entities[0].NAME
+        columns = [field.name for field in entities[0].fields() if field.name != 'id']
+
+        timestamp = datetime.datetime.now()
+        all_values = list()
+        for entity in entities:
+            _data = entity.data()
+            _data['timestamp'] = timestamp
+            all_values.extend(str(_data[k]) if _data[k] not in (0, None, '') else None for k in columns)
+
+        _arg_string = '(%s)' % ('%s,' * len(columns)).rstrip(',')
+        statement = 'INSERT INTO %s(%s) VALUES %s ON CONFLICT ("%s") DO NOTHING' % (
+            entity_name, ', '.join(columns), ','.join([_arg_string] * len(entities)), column)
+        conn = PsycoPGEngine._connect()
+        try:
+            cursor = conn.cursor()
+            LOG.debug('INSERT INTO %s ON CONFLICT (%s) DO NOTHING - %d records.' % (entity_name, column,
+                                                                                   len(entities)))
+            cursor.execute(statement, all_values)
+        finally:
+            PsycoPGEngine._release(conn)
+
+    @staticmethod
+    def _copy_batch(cursor, batch):
+        assert all(x.id is None for x in batch), 'Some entities already exist.'
+
+        entity_name = batch[0].NAME
+        columns = ['id'] + [field.name for field in batch[0].fields() if field.name != 'id']
+        column_names = ', '.join('"%s"' % c for c in columns)
+        # Unique per batch, ON COMMIT DROP keeps every staging table of a transaction alive until its end
+        stage_name = '_stage_%s_%s' % (entity_name, uuid.uuid4().hex[:8])
+
+        # Reserve ids up front so the inserted rows can be matched back to their entities
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id')) AS id FROM generate_series(1, %s)",
+                       (entity_name, len(batch)))
+        for entity, row in zip(batch, cursor.fetchall()):
+            entity.id = row['id']
+
+        cursor.execute('CREATE TEMP TABLE "%s" (LIKE "%s") ON COMMIT DROP' % (stage_name, entity_name))
+
+        timestamp = datetime.datetime.now()
+
+        def _lines():
+            for entity in batch:
+                _data = entity.data()
+                _data['timestamp'] = timestamp
+                yield '\t'.join(_copy_value(_data[k]) for k in columns) + '\n'
+
+        LOG.debug('COPY %s(%s) - %d records.' % (entity_name, column_names, len(batch)))
+        cursor.copy_expert('COPY "%s" (%s) FROM STDIN' % (stage_name, column_names), _CopyStream(_lines()))
+
+        cursor.execute('INSERT INTO "%s" (%s) SELECT %s FROM "%s" RETURNING *' % (entity_name, column_names,
+                                                                                  column_names, stage_name))
+        entities_by_id = {entity.id: entity for entity in batch}
+        for data in cursor.fetchall():
+            entity = entities_by_id[data['id']]
+            for k, v in data.items():
+                setattr(entity, k, v)
 
     @classmethod
-    def select(cls, query):
+    def _fetch(cls, query):
         """
         :type query: file_manager.data.query.Query
         :rtype: list[file_manager.data.base_entity.BaseEntity]
         """
-        statement = query.build_query(query.DBLANG.POSTGRES)
+        statement, params = query.build_query(query.DBLANG.POSTGRES, parameterize=True)
         entity = find_entity(query.table())
 
         conn = PsycoPGEngine._connect()
         try:
-            cursor = conn.cursor()
-            LOG.debug(statement)
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            LOG.debug('%s %s' % (statement, params))
+            cursor.execute(statement, params or None)
+            result = cursor.fetchall()
+            LOG.debug('%s - Found %d records.' % (statement, len(result)))
+            return entity.from_rows(_column_names(cursor), result)
+        finally:
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def iter_select(cls, query, batch_size=None):
+        """
+        Reads through a named server side cursor so only batch_size rows are held client side.
+
+        :type query: file_manager.data.query.Query
+        :type batch_size: int
+        :rtype: collections.Iterator[file_manager.data.base_entity.BaseEntity]
+        """
+        batch_size = batch_size or settings.db_stream_batch_size
+        statement, params = query.build_query(query.DBLANG.POSTGRES, parameterize=True)
+        entity = find_entity(query.table())
+
+        # Never the connection pinned by transaction(), the stream ends with a rollback
+        conn = PsycoPGEngine._pool().acquire()
+        try:
+            # Named cursors only live inside a transaction
+            conn.autocommit = False
+            cursor = conn.cursor(name='fm_stream_%s' % uuid.uuid4().hex, cursor_factory=psycopg2.extensions.cursor)
+            cursor.itersize = batch_size
+            LOG.debug('%s %s (streamed)' % (statement, params))
+            cursor.execute(statement, params or None)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if columns is None:
+                    columns = _column_names(cursor)
+                for record in entity.from_rows(columns, rows):
+                    yield record
+            cursor.close()
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def select_pairs(cls, table, columns, pairs):
+        """
+        :type table: str
+        :type columns: (str, str)
+        :type pairs: collections.Iterable[tuple]
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        """
+        pairs = set(pairs)
+        if not pairs:
+            return list()
+
+        entity = find_entity(table)
+        left, right = zip(*pairs)
+        statement = 'SELECT t.* FROM "%s" AS t JOIN unnest(%%s, %%s) AS p(a, b) ON t."%s" = p.a AND t."%s" = p.b' % (
+            table, columns[0], columns[1])
+
+        conn = PsycoPGEngine._connect()
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            cursor.execute(statement, (list(left), list(right)))
+            result = cursor.fetchall()
+            LOG.debug('%s - %d pairs, Found %d records.' % (statement, len(pairs), len(result)))
+            return IDENTITY_MAP.merge(entity.from_rows(_column_names(cursor), result))
+        finally:
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def count_references(cls, table, key_column, count_column, ref_table, ref_column, expression):
+        """
+        :type table: str
+        :type key_column: str
+        :type count_column: str
+        :type ref_table: str
+        :type ref_column: str
+        :type expression: str
+        :rtype: list[(variant, int, int)]
+        """
+        statement = 'SELECT t."%s", t."%s", (SELECT count(*) FROM "%s" AS r WHERE r."%s" = %s) FROM "%s" AS t'
+        statement %= (key_column, count_column, ref_table, ref_column, expression, table)
+
+        conn = PsycoPGEngine._connect()
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
             cursor.execute(statement)
             result = cursor.fetchall()
-            LOG.debug('%s - Found %d records.' % (cursor.mogrify(statement), len(result)))
-            return [entity(**r) for r in result]
+            LOG.debug('%s - %d rows.' % (statement, len(result)))
+            return result
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
 
     @classmethod
     def update(cls, entity):
@@ -146,7 +402,8 @@ class PsycoPGEngine(BaseEngine):
 
         set_data = ['"%s"=%%s' % column for column in columns]
 
-        statement = "UPDATE %s SET %s WHERE id=%s RETURNING *" % (entity.NAME, ', '.join(set_data), entity.id)
+        statement = "UPDATE %s SET %s WHERE id=%%s RETURNING *" % (entity.NAME, ', '.join(set_data))
+        values.append(entity.id)
         conn = PsycoPGEngine._connect()
         try:
             cursor = conn.cursor()
@@ -157,8 +414,9 @@ class PsycoPGEngine(BaseEngine):
             for k, v in new_data.items():
                 setattr(entity, k, v)
             entity.clear_changes()
+            IDENTITY_MAP.add(entity)
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
 
     @classmethod
     def update_many(cls, entities):
@@ -181,20 +439,8 @@ class PsycoPGEngine(BaseEngine):
 
             set_data = ['"%s"=%%s' % column for column in columns]
 
-            columns = [field.name for field in entities[0].fields() if field.name != 'id']
-
-            all_values = list()
-            for _entity in entities:
-                _data = _entity.data()
-                _data['timestamp'] = datetime.datetime.now()
-                _data.pop('id', None)
-                for k, v in _data.items():
-                    _data[k] = str(v) if v not in (0, None, '') else None
-                entity_values = [_data[k] for k in columns]
-                all_values.extend(entity_values)
-
-            statement = "UPDATE %s SET %s WHERE id=%s;" % (entity_name, ', '.join(set_data), entity.id)
-            cmd_value_pairs.append((statement, values))
+            statement = "UPDATE %s SET %s WHERE id=%%s;" % (entity_name, ', '.join(set_data))
+            cmd_value_pairs.append((statement, values + [entity.id]))
 
         conn = PsycoPGEngine._connect()
         try:
@@ -205,19 +451,20 @@ class PsycoPGEngine(BaseEngine):
                 statements.append(statement)
                 LOG.debug(statement)
             cursor.execute('\n'.join(statements))
+        finally:
+            PsycoPGEngine._release(conn)
 
-            refresh_records = PsycoPGEngine.select(Query(entity_name, id=[_.id for _ in entities]))
-            refresh_records.sort(key=attrgetter('id'))
+        refresh_records = PsycoPGEngine._fetch(Query(entity_name, id=[_.id for _ in entities]))
+        refresh_records.sort(key=attrgetter('id'))
 
-            assert len(entities) == len(refresh_records), 'Updated entity count does not match refresh count.'
+        assert len(entities) == len(refresh_records), 'Updated entity count does not match refresh count.'
 
-            # Apply new data
-            for entity, new_entity in zip(entities, refresh_records):
-                for k, v in new_entity.data():
-                    setattr(entity, k, v)
-                entity.clear_changes()
-        finally:
-            conn.close()
+        # Apply new data
+        for entity, new_entity in zip(entities, refresh_records):
+            for k, v in new_entity.data().items():
+                setattr(entity, k, v)
+            entity.clear_changes()
+            IDENTITY_MAP.add(entity)
 
         # statement = "UPDATE %s SET %s WHERE id=%s RETURNING *" % (entity.NAME, ', '.join(set_data), entity.id)
         # conn = PsycoPGEngine._connect()
@@ -233,6 +480,32 @@ class PsycoPGEngine(BaseEngine):
         # finally:
         #     conn.close()
 
+    @classmethod
+    def increment(cls, table, column, key_column, amounts, minimum=None):
+        """
+        :type table: str
+        :type column: str
+        :type key_column: str
+        :type amounts: dict[variant,int]
+        :type minimum: int or None
+        """
+        if not amounts:
+            return
+
+        expression = 'COALESCE("%s", 0) + %%s' % column
+        if minimum is not None:
+            expression = 'GREATEST(%s, %d)' % (expression, minimum)
+        statement = 'UPDATE "%s" SET "%s" = %s WHERE "%s" = %%s' % (table, column, expression, key_column)
+
+        conn = PsycoPGEngine._connect()
+        try:
+            cursor = conn.cursor()
+            LOG.debug('%s - %d rows.' % (statement, len(amounts)))
+            # Rows locked in the same order by every session, concurrent increments can not deadlock
+            cursor.executemany(statement, [(amount, key) for key, amount in sorted(amounts.items())])
+        finally:
+            PsycoPGEngine._release(conn)
+
     @classmethod
     def delete(cls, entity):
         """
@@ -240,16 +513,17 @@ class PsycoPGEngine(BaseEngine):
         """
         assert entity.id is not None, 'Record has not been created.'
 
-        statement = "DELETE FROM %s WHERE id=%s" % (entity.NAME, entity.id)
+        statement = "DELETE FROM %s WHERE id=%%s" % entity.NAME
         conn = PsycoPGEngine._connect()
         try:
             cursor = conn.cursor()
-            LOG.debug(cursor.mogrify(statement))
-            cursor.execute(statement)
+            LOG.debug(cursor.mogrify(statement, (entity.id,)))
+            cursor.execute(statement, (entity.id,))
+            IDENTITY_MAP.invalidate(entity.NAME, [entity.id])
             entity.id = None
             entity.clear_changes()
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
 
     @classmethod
     def delete_many(cls, entities):
@@ -261,27 +535,126 @@ class PsycoPGEngine(BaseEngine):
 
         assert all(x.id is not None for x in entities), 'Some entities have not been created.'
 
-        if len(entities) > 1:
-            ids = tuple([_.id for _ in entities])
-            statement = "DELETE FROM %s WHERE id in %s" % (entities[0].NAME, str(ids))
-        else:
-            statement = "DELETE FROM %s WHERE id = %s" % (entities[0].NAME, entities[0].id)
+        ids = [_.id for _ in entities]
+        statement = "DELETE FROM %s WHERE id = ANY(%%s)" % entities[0].NAME
 
         conn = PsycoPGEngine._connect()
         try:
             cursor = conn.cursor()
-            LOG.debug(cursor.mogrify(statement))
-            cursor.execute(statement)
+            LOG.debug('%s - %d records.' % (statement, len(ids)))
+            cursor.execute(statement, (ids,))
+            IDENTITY_MAP.invalidate(entities[0].NAME, ids)
             for entity in entities:
                 entity.id = None
                 entity.clear_changes()
         finally:
-            conn.close()
+            PsycoPGEngine._release(conn)
+
+    @classmethod
+    def delete_if(cls, entities, column, value):
+        """
+        :type entities: list[BaseEntity]
+        :type column: str
+        :type value: variant
+        :rtype: list[BaseEntity]
+        """
+        if not entities:
+            return list()
+
+        assert all(x.id is not None for x in entities), 'Some entities have not been created.'
+
+        table = entities[0].NAME
+        ids = [_.id for _ in entities]
+        # A row locked by another transaction is checked again once that commits
+        statement = 'DELETE FROM "%s" WHERE id = ANY(%%s) AND "%s" = %%s RETURNING id' % (table, column)
+
+        conn = PsycoPGEngine._connect()
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+            LOG.debug('%s - %d records.' % (statement, len(ids)))
+            cursor.execute(statement, (ids, value))
+            deleted = set(_[0] for _ in cursor.fetchall())
+        finally:
+            PsycoPGEngine._release(conn)
+
+        IDENTITY_MAP.invalidate(table, ids)
+        result = [_ for _ in entities if _.id in deleted]
+        for entity in result:
+            entity.id = None
+            entity.clear_changes()
+        return result
+
+    @staticmethod
+    def pool_stats():
+        """
+        :rtype: dict[str,int]
+        :return: Pool counters (hits, waits, created, closed, failed_checks, idle, in_use)
+        """
+        return PsycoPGEngine._pool().stats()
+
+    @staticmethod
+    def _pool():
+        """
+        :rtype: file_manager.data.pool.ConnectionPool
+        """
+        global _POOL
+        if _POOL is None:
+            with _POOL_LOCK:
+                if _POOL is None:
+                    _POOL = ConnectionPool(PsycoPGEngine._new_connection,
+                                           min_size=settings.db_pool_min_size,
+                                           max_size=settings.db_pool_max_size,
+                                           idle_timeout=settings.db_pool_idle_timeout,
+                                           wait_timeout=settings.db_pool_wait_timeout,
+                                           health_check=PsycoPGEngine._check_connection)
+        return _POOL
 
     @staticmethod
     def _connect():
         """
-        :rtype: psycopg2.psycopg1.cursor
+        Borrow a connection from the pool, must be handed back with _release. Inside transaction() this is the
+        connection pinned to the thread.
+
+        :rtype: psycopg2.extensions.connection
+        """
+        conn = getattr(_LOCAL, 'conn', None)
+        if conn is not None:
+            return conn
+        return PsycoPGEngine._pool().acquire()
+
+    @staticmethod
+    def _release(conn):
+        if conn is getattr(_LOCAL, 'conn', None):
+            # Handed back by transaction() once it ends
+            return
+
+        status = conn.get_transaction_status() if not conn.closed else None
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            # Connection to the server was lost
+            PsycoPGEngine._pool().release(conn, discard=True)
+            return
+
+        if status in (psycopg2.extensions.TRANSACTION_STATUS_INTRANS, psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                PsycoPGEngine._pool().release(conn, discard=True)
+                return
+
+        PsycoPGEngine._pool().release(conn)
+
+    @staticmethod
+    def _check_connection(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _new_connection():
+        """
+        :rtype: psycopg2.extensions.connection
         """
         conn = psycopg2.connect(
             host=settings.db_host,
@@ -310,3 +683,39 @@ class PsycoPGEngine(BaseEngine):
             return 'TIMESTAMP WITH TIME ZONE'
         else:
             raise Exception('Invalid type %s, could not map to engine.' % typ)
+
+
+def _column_names(cursor):
+    return [d[0] for d in cursor.description]
+
+
+class _CopyStream(object):
+    """
+    Minimal file-like object feeding COPY FROM STDIN from an iterator of lines.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+
+        if size < 0:
+            size = len(self._buffer)
+        result, self._buffer = self._buffer[:size], self._buffer[size:]
+        return result
+
+
+def _copy_value(value):
+    """
+    Format a value for the COPY text format, matching the conversion used by create.
+    """
+    if value in (0, None, ''):
+        return '\\N'
+    value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
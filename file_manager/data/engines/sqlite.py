@@ -1,15 +1,24 @@
+import contextlib
 import datetime
+import itertools
 import os
 import re
 import sqlite3
+import threading
 from operator import attrgetter
 
 from .base_engine import BaseEngine
 from ..entities import find_entity
 from ..field import Field
+from ..identity_map import IDENTITY_MAP
 from ..query import Query
 from ...config import settings, LOG
 
+_LOCAL = threading.local()
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# Default SQLITE_MAX_VARIABLE_NUMBER, raised from 999 in 3.32
+_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
 
 class SqliteEngine(BaseEngine):
     @classmethod
@@ -20,27 +29,57 @@ class SqliteEngine(BaseEngine):
         assert entity_class.NAME is not None, 'Entity %s does not have a NAME.' % entity_class
 
         conn = SqliteEngine._connect()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('CREATE TABLE "%s" (id INTEGER PRIMARY KEY NOT NULL);' % entity_class.NAME)
-        except sqlite3.Error as e:
-            if 'already exists' in str(e) or 'duplicate column name' in str(e):
-                LOG.debug('Table %s already exists.' % entity_class.NAME)
-            else:
-                raise
-
-        for field in entity_class.fields():
-            if not isinstance(field, Field) or field.name == 'id':
-                continue
+        with SqliteEngine.transaction():
+            cursor = conn.cursor()
             try:
-                cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (entity_class.NAME, field.name,
-                                                                         SqliteEngine._map_type(field.type)))
+                cursor.execute('CREATE TABLE "%s" (id INTEGER PRIMARY KEY NOT NULL);' % entity_class.NAME)
             except sqlite3.Error as e:
                 if 'already exists' in str(e) or 'duplicate column name' in str(e):
-                    LOG.debug('Column %s.%s already exists.' % (entity_class.NAME, field.name))
+                    LOG.debug('Table %s already exists.' % entity_class.NAME)
                 else:
                     raise
 
+            for field in entity_class.fields():
+                if not isinstance(field, Field) or field.name == 'id':
+                    continue
+                try:
+                    cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s;' % (entity_class.NAME, field.name,
+                                                                             SqliteEngine._map_type(field.type)))
+                except sqlite3.Error as e:
+                    if 'already exists' in str(e) or 'duplicate column name' in str(e):
+                        LOG.debug('Column %s.%s already exists.' % (entity_class.NAME, field.name))
+                    else:
+                        raise
+
+            for name, columns, unique in SqliteEngine._index_definitions(entity_class):
+                try:
+                    cursor.execute(SqliteEngine._index_statement(entity_class, name, columns, unique))
+                except sqlite3.IntegrityError as e:
+                    LOG.warning('Could not create unique index %s, existing rows are not unique: %s' % (name, e))
+
+    @classmethod
+    @contextlib.contextmanager
+    def transaction(cls):
+        """
+        Writes made by the engine inside the block share the connection of the thread and are committed together.
+
+        :rtype: contextlib.GeneratorContextManager
+        """
+        conn = SqliteEngine._connect()
+        if getattr(_LOCAL, 'in_transaction', False):
+            yield
+            return
+
+        _LOCAL.in_transaction = True
+        try:
+            with conn:
+                yield
+        except:
+            IDENTITY_MAP.clear()
+            raise
+        finally:
+            _LOCAL.in_transaction = False
+
     @classmethod
     def create(cls, entity):
         """
@@ -49,65 +88,209 @@ class SqliteEngine(BaseEngine):
         """
         assert entity.id is None, 'Record [%s] already created.' % entity.id
 
-        fields = entity.fields()
-        columns = [field.name for field in fields if field.name != 'id']
+        cls.create_many([entity])
+        return entity
 
-        data = entity.data()
-        data['timestamp'] = datetime.datetime.now()
-        data.pop('id', None)
-        for k, v in data.items():
-            data[k] = str(v) if v not in (0, None, '') else None
+    @classmethod
+    def create_many(cls, entities):
+        """
+        Insert all entities inside a single transaction and apply the new ids and timestamps to them.
 
-        entity_values = [data[k] for k in columns]
+        :type entities: list[file_manager.data.base_entity.BaseEntity]
+        """
+        if not entities:
+            return
 
-        values = ('?,' * len(columns)).rstrip(',')
-        statement = "INSERT INTO %s(%s) VALUES (%s)" % (entity.NAME, ', '.join(columns), values)
+        assert all(x.id is None for x in entities), 'Some entities already exist.'
+
+        entity_name = entities[0].NAME
+        fields = [field for field in entities[0].fields() if field.name != 'id']
+        columns = [field.name for field in fields]
+
+        timestamp = datetime.datetime.now()
+        all_values = list()
+        for entity in entities:
+            _data = entity.data()
+            _data['timestamp'] = timestamp
+            all_values.append([str(_data[k]) if _data[k] not in (0, None, '') else None for k in columns])
+
+        column_names = ', '.join('"%s"' % c for c in columns)
+        arg_string = '(%s)' % ('?,' * len(columns)).rstrip(',')
+        chunk_size = max(1, _MAX_VARIABLES // len(columns))
+
+        LOG.debug('INSERT INTO %s(%s) - %d records.' % (entity_name, column_names, len(entities)))
         conn = SqliteEngine._connect()
-        try:
+        with SqliteEngine.transaction():
             cursor = conn.cursor()
-            # LOG.debug(statement % tuple(entity_values))
-            cursor.execute(statement, entity_values)
-            last_id = cursor.lastrowid
-        finally:
-            conn.commit()
-            conn.close()
+            if _HAS_RETURNING:
+                for i in range(0, len(entities), chunk_size):
+                    chunk = all_values[i:i + chunk_size]
+                    statement = 'INSERT INTO %s(%s) VALUES %s RETURNING *' % (entity_name, column_names,
+                                                                             ','.join([arg_string] * len(chunk)))
+                    cursor.execute(statement, [v for values in chunk for v in values])
+                    # RETURNING order is not guaranteed, rowids are handed out in VALUES order
+                    new_records = sorted(cursor.fetchall(), key=lambda r: r['id'])
+                    for entity, new_data in zip(entities[i:i + chunk_size], new_records):
+                        for k in new_data.keys():
+                            setattr(entity, k, new_data[k])
+            else:
+                statement = 'INSERT INTO %s(%s) VALUES %s' % (entity_name, column_names, arg_string)
+                cursor.executemany(statement, all_values)
+                # The write lock is held until commit, so the new rowids are the contiguous range ending at max(id)
+                last_id = cursor.execute('SELECT max(id) FROM %s' % entity_name).fetchone()[0]
+                first_id = last_id - len(entities) + 1
+                for new_id, entity, values in zip(range(first_id, last_id + 1), entities, all_values):
+                    entity.id = new_id
+                    for field, value in zip(fields, values):
+                        setattr(entity, field.name, _apply_affinity(field.type, value))
 
-        new_entity = cls.select(Query(entity.NAME, id=int(last_id)))[0]
-        # Apply new data
-        for k, v in new_entity.data().items():
-            setattr(entity, k, v)
-        entity.clear_changes()
-        return entity
+        for entity in entities:
+            entity.clear_changes()
 
     @classmethod
-    def create_many(cls, entities):
-        assert all(x.id is None for x in entities), 'Some entities already exist.'
+    def bulk_load(cls, entities, batch_size=None):
+        """
+        Insert entities in batches, each batch in its own transaction unless called inside transaction().
+
+        :type entities: collections.Iterable[file_manager.data.base_entity.BaseEntity]
+        :param entities: Entities of a single type, may be a generator
+        :type batch_size: int
+        :param batch_size: Number of entities per batch, defaults to bulk_batch_size in settings.ini
+        """
+        batch_size = batch_size or settings.db_bulk_batch_size
+        entities = iter(entities)
+        while True:
+            batch = list(itertools.islice(entities, batch_size))
+            if not batch:
+                break
+            cls.create_many(batch)
+
+    @classmethod
+    def create_missing(cls, entities, column):
+        """
+        :type entities: list[file_manager.data.base_entity.BaseEntity]
+        :type column: str
+        """
+        if not entities:
+            return
+
+        entity_name = entities[0].NAME
+        columns = [field.name for field in entities[0].fields() if field.name != 'id']
 
-        # SQLite cannot return multiple results back from an INSERT many statement
+        timestamp = datetime.datetime.now()
+        all_values = list()
         for entity in entities:
-            cls.create(entity)
+            _data = entity.data()
+            _data['timestamp'] = timestamp
+            all_values.append([str(_data[k]) if _data[k] not in (0, None, '') else None for k in columns])
+
+        # OR IGNORE skips rows breaking the unique index of column, the only one the callers rely on
+        statement = 'INSERT OR IGNORE INTO %s(%s) VALUES (%s)' % (entity_name, ', '.join('"%s"' % c for c in columns),
+                                                                 ('?,' * len(columns)).rstrip(','))
+        LOG.debug('INSERT OR IGNORE INTO %s - %d records on %s.' % (entity_name, len(entities), column))
+        conn = SqliteEngine._connect()
+        with SqliteEngine.transaction():
+            conn.cursor().executemany(statement, all_values)
 
     @classmethod
-    def select(cls, query):
+    def _fetch(cls, query):
         """
         :type query: file_manager.data.query.Query
         :rtype: list[file_manager.data.base_entity.BaseEntity]
         """
-        statement = query.build_query(query.DBLANG.SQLITE)
+        statement, params = query.build_query(query.DBLANG.SQLITE, parameterize=True)
+        if len(params) > _MAX_VARIABLES:
+            # Too many values to bind, inline them instead
+            statement, params = query.build_query(query.DBLANG.SQLITE), list()
         entity = find_entity(query.table())
 
         conn = SqliteEngine._connect()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        LOG.debug('%s %s' % (statement, params))
+        cursor.execute(statement, params)
+        result = cursor.fetchall()
+        LOG.debug('%s - Found %d records.' % (statement, len(result)))
+        return entity.from_rows(_column_names(cursor), result)
+
+    @classmethod
+    def iter_select(cls, query, batch_size=None):
+        """
+        Runs on its own connection so writes made while iterating do not disturb the open statement.
+
+        :type query: file_manager.data.query.Query
+        :type batch_size: int
+        :rtype: collections.Iterator[file_manager.data.base_entity.BaseEntity]
+        """
+        batch_size = batch_size or settings.db_stream_batch_size
+        statement, params = query.build_query(query.DBLANG.SQLITE, parameterize=True)
+        if len(params) > _MAX_VARIABLES:
+            statement, params = query.build_query(query.DBLANG.SQLITE), list()
+        entity = find_entity(query.table())
+
+        conn = SqliteEngine._open()
         try:
             cursor = conn.cursor()
-            LOG.debug(statement)
-            cursor.execute(statement)
-            result = cursor.fetchall()
-            LOG.debug('%s - Found %d records.' % (statement, len(result)))
-            return [entity(**r) for r in result]
+            cursor.row_factory = None
+            LOG.debug('%s %s (streamed)' % (statement, params))
+            cursor.execute(statement, params)
+            columns = _column_names(cursor)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for record in entity.from_rows(columns, rows):
+                    yield record
         finally:
-            conn.commit()
             conn.close()
 
+    @classmethod
+    def select_pairs(cls, table, columns, pairs):
+        """
+        :type table: str
+        :type columns: (str, str)
+        :type pairs: collections.Iterable[tuple]
+        :rtype: list[file_manager.data.base_entity.BaseEntity]
+        """
+        pairs = list(set(pairs))
+        entity = find_entity(table)
+
+        conn = SqliteEngine._connect()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        result = list()
+        chunk_size = _MAX_VARIABLES // 2
+        for i in range(0, len(pairs), chunk_size):
+            chunk = pairs[i:i + chunk_size]
+            values = ','.join(['(?, ?)'] * len(chunk))
+            statement = 'SELECT t.* FROM "%s" AS t JOIN (VALUES %s) AS p ON t."%s" = p.column1 AND t."%s" = p.column2'
+            statement %= (table, values, columns[0], columns[1])
+            cursor.execute(statement, [v for pair in chunk for v in pair])
+            result.extend(cursor.fetchall())
+        LOG.debug('SELECT %s - %d pairs, Found %d records.' % (table, len(pairs), len(result)))
+        return IDENTITY_MAP.merge(entity.from_rows(_column_names(cursor), result)) if result else list()
+
+    @classmethod
+    def count_references(cls, table, key_column, count_column, ref_table, ref_column, expression):
+        """
+        :type table: str
+        :type key_column: str
+        :type count_column: str
+        :type ref_table: str
+        :type ref_column: str
+        :type expression: str
+        :rtype: list[(variant, int, int)]
+        """
+        statement = 'SELECT t."%s", t."%s", (SELECT count(*) FROM "%s" AS r WHERE r."%s" = %s) FROM "%s" AS t'
+        statement %= (key_column, count_column, ref_table, ref_column, expression, table)
+
+        conn = SqliteEngine._connect()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        result = cursor.execute(statement).fetchall()
+        LOG.debug('%s - %d rows.' % (statement, len(result)))
+        return result
+
     @classmethod
     def update(cls, entity):
         """
@@ -137,38 +320,22 @@ class SqliteEngine(BaseEngine):
             values = changes.values()
             values = [str(v) if v not in (0, None, '') else None for v in values]
 
-            set_data = ['"%s"=?' % column for column in columns]
-
-            columns = [field.name for field in entities[0].fields() if field.name != 'id']
+            if not values:
+                continue
 
-            all_values = list()
-            for _entity in entities:
-                _data = _entity.data()
-                _data['timestamp'] = datetime.datetime.now()
-                _data.pop('id', None)
-                for k, v in _data.items():
-                    _data[k] = str(v) if v not in (0, None, '') else None
-                entity_values = [_data[k] for k in columns]
-                all_values.extend(entity_values)
+            set_data = ['"%s"=?' % column for column in columns]
 
-            statement = "UPDATE %s SET %s WHERE id=%s;" % (entity_name, ', '.join(set_data), entity.id)
-            cmd_value_pairs.append((statement, values))
+            statement = "UPDATE %s SET %s WHERE id=?;" % (entity_name, ', '.join(set_data))
+            cmd_value_pairs.append((statement, values + [entity.id]))
 
         conn = SqliteEngine._connect()
-        try:
+        with SqliteEngine.transaction():
             cursor = conn.cursor()
-            statements = list()
-            all_values = list()
             for cmd, values in cmd_value_pairs:
                 LOG.debug(cmd)
-                statements.append(cmd)
-                all_values.extend(values)
-            cursor.execute('\n'.join(statements), all_values)
-        finally:
-            conn.commit()
-            conn.close()
+                cursor.execute(cmd, values)
 
-        refresh_records = SqliteEngine.select(Query(entity_name, id=[_.id for _ in entities]))
+        refresh_records = SqliteEngine._fetch(Query(entity_name, id=[_.id for _ in entities]))
         refresh_records.sort(key=attrgetter('id'))
 
         assert len(entities) == len(refresh_records), 'Updated entity count does not match refresh count.'
@@ -178,6 +345,7 @@ class SqliteEngine(BaseEngine):
             for k, v in new_entity.data().items():
                 setattr(entity, k, v)
             entity.clear_changes()
+            IDENTITY_MAP.add(entity)
 
         # statement = "UPDATE %s SET %s WHERE id=%s RETURNING *" % (entity.NAME, ', '.join(set_data), entity.id)
         # conn = SqliteEngine._connect()
@@ -194,6 +362,28 @@ class SqliteEngine(BaseEngine):
         #     conn.commit()
         #     conn.close()
 
+    @classmethod
+    def increment(cls, table, column, key_column, amounts, minimum=None):
+        """
+        :type table: str
+        :type column: str
+        :type key_column: str
+        :type amounts: dict[variant,int]
+        :type minimum: int or None
+        """
+        if not amounts:
+            return
+
+        expression = 'COALESCE("%s", 0) + ?' % column
+        if minimum is not None:
+            expression = 'MAX(%s, %d)' % (expression, minimum)
+        statement = 'UPDATE "%s" SET "%s" = %s WHERE "%s" = ?' % (table, column, expression, key_column)
+
+        LOG.debug('%s - %d rows.' % (statement, len(amounts)))
+        conn = SqliteEngine._connect()
+        with SqliteEngine.transaction():
+            conn.cursor().executemany(statement, [(amount, key) for key, amount in sorted(amounts.items())])
+
     @classmethod
     def delete(cls, entity):
         """
@@ -201,17 +391,15 @@ class SqliteEngine(BaseEngine):
         """
         assert entity.id is not None, 'Record has not been created.'
 
-        statement = "DELETE FROM %s WHERE id=%s" % (entity.NAME, entity.id)
+        statement = "DELETE FROM %s WHERE id=?" % entity.NAME
         conn = SqliteEngine._connect()
-        try:
+        with SqliteEngine.transaction():
             cursor = conn.cursor()
-            LOG.debug(statement)
-            cursor.execute(statement)
-            entity.id = None
-            entity.clear_changes()
-        finally:
-            conn.commit()
-            conn.close()
+            LOG.debug('%s %s' % (statement, entity.id))
+            cursor.execute(statement, (entity.id,))
+        IDENTITY_MAP.invalidate(entity.NAME, [entity.id])
+        entity.id = None
+        entity.clear_changes()
 
     @classmethod
     def delete_many(cls, entities):
@@ -223,33 +411,99 @@ class SqliteEngine(BaseEngine):
 
         assert all(x.id is not None for x in entities), 'Some entities have not been created.'
 
-        if len(entities) > 1:
-            ids = tuple([_.id for _ in entities])
-            statement = "DELETE FROM %s WHERE id in %s" % (entities[0].NAME, str(ids))
-        else:
-            statement = "DELETE FROM %s WHERE id = %s" % (entities[0].NAME, entities[0].id)
+        ids = [_.id for _ in entities]
+        conn = SqliteEngine._connect()
+        with SqliteEngine.transaction():
+            cursor = conn.cursor()
+            for i in range(0, len(ids), _MAX_VARIABLES):
+                chunk = ids[i:i + _MAX_VARIABLES]
+                statement = "DELETE FROM %s WHERE id IN (%s)" % (entities[0].NAME, ', '.join('?' * len(chunk)))
+                LOG.debug('DELETE FROM %s - %d records.' % (entities[0].NAME, len(chunk)))
+                cursor.execute(statement, chunk)
+        IDENTITY_MAP.invalidate(entities[0].NAME, ids)
+        for entity in entities:
+            entity.id = None
+            entity.clear_changes()
 
+    @classmethod
+    def delete_if(cls, entities, column, value):
+        """
+        :type entities: list[BaseEntity]
+        :type column: str
+        :type value: variant
+        :rtype: list[BaseEntity]
+        """
+        if not entities:
+            return list()
+
+        assert all(x.id is not None for x in entities), 'Some entities have not been created.'
+
+        table = entities[0].NAME
+        deleted = set()
         conn = SqliteEngine._connect()
-        try:
+        with SqliteEngine.transaction():
             cursor = conn.cursor()
-            LOG.debug(statement)
-            cursor.execute(statement)
-            for entity in entities:
-                entity.id = None
-                entity.clear_changes()
-        finally:
-            conn.commit()
-            conn.close()
+            cursor.row_factory = None
+            LOG.debug('DELETE FROM %s WHERE %s = %r - %d records.' % (table, column, value, len(entities)))
+            if _HAS_RETURNING:
+                chunk_size = _MAX_VARIABLES - 1
+                for i in range(0, len(entities), chunk_size):
+                    chunk = [_.id for _ in entities[i:i + chunk_size]]
+                    statement = 'DELETE FROM "%s" WHERE id IN (%s) AND "%s" = ? RETURNING id' % (
+                        table, ', '.join('?' * len(chunk)), column)
+                    deleted.update(_[0] for _ in cursor.execute(statement, chunk + [value]).fetchall())
+            else:
+                # One row at a time, the row count tells which of them still held the value
+                statement = 'DELETE FROM "%s" WHERE id = ? AND "%s" = ?' % (table, column)
+                for entity in entities:
+                    if cursor.execute(statement, (entity.id, value)).rowcount:
+                        deleted.add(entity.id)
+
+        IDENTITY_MAP.invalidate(table, [_.id for _ in entities])
+        result = [_ for _ in entities if _.id in deleted]
+        for entity in result:
+            entity.id = None
+            entity.clear_changes()
+        return result
 
     @staticmethod
     def _connect():
         """
-        :rtype: psycopg2.psycopg1.cursor
+        Connections are kept open for the life of the calling thread, writes should be wrapped
+        in a "with SqliteEngine.transaction():" block to commit or roll back.
+
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(_LOCAL, 'conn', None)
+        if conn is not None and _LOCAL.path == settings.db_host:
+            return conn
+
+        if conn is not None:
+            conn.close()
+
+        _LOCAL.conn = SqliteEngine._open()
+        _LOCAL.path = settings.db_host
+        return _LOCAL.conn
+
+    @staticmethod
+    def _open():
+        """
+        :rtype: sqlite3.Connection
         """
         assert os.path.isfile(settings.db_host), 'Please set the database file path to "host" in settings.ini.'
         conn = sqlite3.connect(settings.db_host)
         conn.row_factory = sqlite3.Row
         conn.create_function("REGEXP", 2, _regexp)
+
+        cursor = conn.cursor()
+        mode = cursor.execute('PRAGMA journal_mode=%s' % settings.sqlite_journal_mode).fetchone()[0]
+        if mode.lower() != settings.sqlite_journal_mode.lower():
+            LOG.warning('Could not set sqlite journal_mode to %s, using %s.' % (settings.sqlite_journal_mode, mode))
+        cursor.execute('PRAGMA synchronous=%s' % settings.sqlite_synchronous)
+        cursor.execute('PRAGMA cache_size=%d' % settings.sqlite_cache_size)
+        cursor.execute('PRAGMA mmap_size=%d' % settings.sqlite_mmap_size)
+        cursor.execute('PRAGMA temp_store=%s' % settings.sqlite_temp_store)
+        cursor.close()
         return conn
 
     @staticmethod
@@ -268,5 +522,23 @@ class SqliteEngine(BaseEngine):
             raise Exception('Invalid type %s, could not map to engine.' % typ)
 
 
+def _column_names(cursor):
+    return [d[0] for d in cursor.description]
+
+
+def _apply_affinity(typ, value):
+    """
+    Convert a bound value the same way sqlite column affinity would when it is read back.
+    """
+    try:
+        if typ in (int,):
+            return int(value)
+        elif typ in (float,):
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
 def _regexp(expr, item):
     return re.compile(expr.lower()).search(item.lower()) is not None
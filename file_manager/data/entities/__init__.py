@@ -3,6 +3,7 @@ from ...data.entities.asset import AssetEntity
 from ...data.entities.path import PathEntity
 from ...data.entities.tag import TagEntity
 from ...data.entities.tag_to_asset import TagToAssetEntity
+from ...data.entities.thumbnail import ThumbnailEntity
 
 
 def find_entity(name):
@@ -7,7 +7,7 @@ class ApplicationEntity(BaseEntity):
 
     name = Field(str)
     executable_win = Field(str)
-    file_type = Field(str)
+    file_type = Field(str, index=True)
     icon = Field(str)
 
     def __init__(self, name, file_type, **kwargs):
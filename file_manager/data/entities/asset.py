@@ -1,19 +1,16 @@
-import os
-import shutil
-
 from .base_entity import BaseEntity
 from ..connection import get_engine
 from ..entities.tag_to_asset import TagToAssetEntity
+from ..entities.thumbnail import ThumbnailEntity
 from ..field import Field
 from ..query import Query
-from ...config import settings
 
 
 class AssetEntity(BaseEntity):
     NAME = 'asset'
 
-    name = Field(str)
-    thumbnail = Field(str)
+    name = Field(str, index=True)
+    thumbnail = Field(str, index=True)
 
     @classmethod
     def delete(cls, records):
@@ -26,15 +23,7 @@ class AssetEntity(BaseEntity):
         engine.delete_many(paths)
         engine.delete_many(records)
 
-        for record in records:
-            if record.thumbnail:
-                folder = settings.thumbs_folder
-                path = os.path.join(folder, record.thumbnail)
-                if os.path.isfile(path):
-                    try:
-                        os.remove(path)
-                    except WindowsError:
-                        pass
+        ThumbnailEntity.release([record.thumbnail for record in records])
 
     @classmethod
     def merge(cls, asset_records, new_name):
@@ -60,16 +49,11 @@ class AssetEntity(BaseEntity):
         return asset
 
     def assign_thumbnail(self, thumb_file_path):
-        assert os.path.isfile(thumb_file_path), 'File does not exist %s' % thumb_file_path
-
-        ext = thumb_file_path.rsplit('.', 1)[-1].lower()
-        assert ext in ('png', 'gif', 'jpg'), 'Only jpg or png file types allowed for thumbnails.'
-
-        repo_path = os.path.join(settings.thumbs_folder, '%s.%s' % (self.id, ext))
+        thumbnail_record = ThumbnailEntity.store(thumb_file_path)
 
-        # Copy file to proper location if not the same file
-        if os.path.abspath(thumb_file_path).replace('\\', '/') != os.path.abspath(repo_path).replace('\\', '/'):
-            shutil.copy(thumb_file_path, repo_path)
-
-        self.thumbnail = repo_path
+        old_thumbnail = self.thumbnail
+        self.thumbnail = thumbnail_record.filename
         get_engine().update(self)
+
+        # Released after the new reference was taken so assigning the same image again keeps the file
+        ThumbnailEntity.release([old_thumbnail])
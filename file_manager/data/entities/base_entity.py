@@ -1,66 +1,141 @@
 import datetime
 import getpass
-import inspect
+from operator import attrgetter
 
 from ..connection import get_engine
 from ..field import Field
 
 
-class BaseEntity(object):
+class _EntityMeta(type):
+    """
+    Collects the Field attributes of each entity class once, when the class is created, and turns
+    them into __slots__ so instances carry no per-instance __dict__.
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        own_fields = list()
+        for attr_name, attr in list(attrs.items()):
+            if isinstance(attr, Field):
+                attr.name = attr_name.strip('_')
+                own_fields.append(attr)
+                del attrs[attr_name]
+        attrs['__slots__'] = tuple(attrs.get('__slots__', ())) + tuple(field.name for field in own_fields)
+
+        cls = super(_EntityMeta, mcs).__new__(mcs, name, bases, attrs)
+
+        fields = list(own_fields)
+        for base in bases:
+            fields.extend(getattr(base, '_fields', ()))
+        fields.sort(key=attrgetter('order'))
+
+        cls._fields = tuple(fields)
+        cls._field_map = dict((field.name, field) for field in fields)
+        # Each field owns one bit of the instance's _dirty mask
+        cls._field_bits = dict((field.name, 1 << i) for i, field in enumerate(fields) if field.name != 'id')
+        return cls
+
+
+# Python 2 and 3 compatible way of applying the metaclass
+_Entity = _EntityMeta('_Entity', (object,), {'__slots__': ('_dirty',)})
+_USERNAME = None
+
+
+class BaseEntity(_Entity):
     NAME = None  # Name of table
+    UNIQUE_TOGETHER = ()  # Column name tuples that get a composite unique index
     id = Field(int)
     timestamp = Field(datetime.datetime)
     username = Field(str)
 
     @classmethod
     def fields(cls):
-        values = inspect.getmembers(cls)
-        fields = list()
-        for name, attr in values:
-            if isinstance(attr, Field):
-                attr.name = name.strip('_')
-                fields.append(attr)
-        fields.sort(key=lambda _: _.order)
-        return fields
+        """
+        :rtype: tuple[Field]
+        """
+        return cls._fields
+
+    @classmethod
+    def field_map(cls):
+        """
+        :rtype: dict[str,Field]
+        :return: Fields by name, shared by every instance so it must not be modified
+        """
+        return cls._field_map
+
+    @classmethod
+    def from_row(cls, columns, row):
+        """
+        :type columns: list[str]
+        :type row: tuple
+        :rtype: BaseEntity
+        """
+        return cls.from_rows(columns, [row])[0]
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """
+        Build entities straight from cursor rows without running __init__, the loaded values are not
+        recorded as changes.
+
+        :type columns: list[str]
+        :param columns: Column names in cursor order, unknown columns are ignored
+        :type rows: collections.Iterable[tuple]
+        :rtype: list[BaseEntity]
+        """
+        field_map = cls._field_map
+        setters = [(i, getattr(cls, column).__set__) for i, column in enumerate(columns) if column in field_map]
+        defaults = [getattr(cls, name).__set__ for name in field_map if name not in columns]
+        set_dirty = _Entity._dirty.__set__
+
+        result = list()
+        new = object.__new__
+        for row in rows:
+            entity = new(cls)
+            set_dirty(entity, 0)
+            for setter in defaults:
+                setter(entity, None)
+            for i, setter in setters:
+                setter(entity, row[i])
+            result.append(entity)
+        return result
 
     @classmethod
     def delete(cls, records):
         get_engine().delete_many(records)
 
     def __init__(self, **data):
-        self._changes = dict()
+        global _USERNAME
+        if _USERNAME is None:
+            _USERNAME = getpass.getuser().lower()
 
-        self.id = None
-        self.username = getpass.getuser().lower()
+        self._dirty = 0
+        for field in self._fields:
+            setattr(self, field.name, None)
+        self.username = _USERNAME
 
-        field_names = [field.name for field in self.fields()]
+        field_map = self._field_map
         for k, v in data.items():
-            assert k in field_names, 'Field "%s" does not exist on %s' % (k, self)
+            assert k in field_map, 'Field "%s" does not exist on %s' % (k, self)
             setattr(self, k, v)
 
-        for field in field_names:
-            if isinstance(getattr(self, field), Field):
-                setattr(self, field, None)
-
     def __setattr__(self, key, value):
-        old_value = getattr(self.__class__, key, None)
         super(BaseEntity, self).__setattr__(key, value)
 
-        attr = getattr(self.__class__, key, None)
-        if isinstance(attr, Field):
-            if value != old_value and key != 'id':
-                # LOG.debug('Value changed to %s' % value)
-                self._changes[key] = value
+        bit = self._field_bits.get(key)
+        if bit:
+            self._dirty |= bit
 
     def changes(self):
-        return self._changes.copy()
+        dirty = self._dirty
+        if not dirty:
+            return dict()
+        return dict((name, getattr(self, name)) for name, bit in self._field_bits.items() if dirty & bit)
 
     def clear_changes(self):
-        self._changes = dict()
+        self._dirty = 0
 
     def data(self):
-        fields = self.fields()
         result = dict()
-        for field in fields:
+        for field in self._fields:
             result[field.name] = getattr(self, field.name)
         return result
@@ -7,8 +7,8 @@ from ..field import Field
 class PathEntity(BaseEntity):
     NAME = 'path'
 
-    asset_id = Field(int)
-    filepath = Field(str)
+    asset_id = Field(int, index=True)
+    filepath = Field(str, index=True)
     sub_folders = Field(str)
     type = Field(str)
 
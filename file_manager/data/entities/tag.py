@@ -9,7 +9,7 @@ from ..query import Query
 class TagEntity(BaseEntity):
     NAME = 'tag'
 
-    name = Field(str)
+    name = Field(str, index=True)
     fg_color = Field(str)
     bg_color = Field(str)
 
@@ -6,8 +6,9 @@ from ..query import Query
 
 class TagToAssetEntity(BaseEntity):
     NAME = 'tag_to_asset'
+    UNIQUE_TOGETHER = (('asset_id', 'tag_id'),)
 
-    tag_id = Field(int)
+    tag_id = Field(int, index=True)
     asset_id = Field(int)
 
     def __init__(self, asset_id, tag_id, **kwargs):
@@ -54,18 +55,7 @@ class TagToAssetEntity(BaseEntity):
 
     @classmethod
     def _find_existing(cls, asset_records, tag_records):
-        asset_ids = [x.id for x in asset_records]
-        tag_ids = [x.id for x in tag_records]
-
-        q = Query('tag_to_asset')
-        q.start_filter_group(q.OP.OR)
-        for asset_id in asset_ids:
-            for tag_id in tag_ids:
-                q.start_filter_group(q.OP.AND)
-                q.add_filter('asset_id', asset_id)
-                q.add_filter('tag_id', tag_id)
-                q.end_filter_group()
-        q.end_filter_group()
+        pairs = [(asset.id, tag.id) for asset in asset_records for tag in tag_records]
 
         engine = get_engine()
-        return engine.select(q)
+        return engine.select_pairs(cls.NAME, ('asset_id', 'tag_id'), pairs)
@@ -0,0 +1,285 @@
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+
+from .base_entity import BaseEntity
+from ..connection import get_engine
+from ..field import Field
+from ..query import Query
+from ...config import settings, LOG
+from ...thumbnails import generate_variants, remove_variants
+
+EXTENSIONS = ('png', 'gif', 'jpg')
+ORPHAN_AGE = 3600  # Seconds before an unreferenced file is removed, another session may be storing it
+_CHUNK_SIZE = 1024 * 1024
+_COLLECT_BATCH_SIZE = 500  # Names per IN (...) when checking assets, well under the sqlite parameter limit
+_FILENAME_SQL = "substr(t.sha1, 1, 2) || '/' || t.sha1 || '.' || t.ext"  # thumbnail_filename in SQL
+
+
+class ThumbnailEntity(BaseEntity):
+    """
+    A thumbnail image stored once in the thumbnail folder under the sha1 of its content, however many assets use it.
+
+    Files live in a sub folder named after the first two characters of the hash so no folder of the share grows too
+    large. ref_count is the number of assets pointing at the file, blobs are removed once it drops to zero.
+    """
+    NAME = 'thumbnail'
+
+    sha1 = Field(str, unique=True)
+    ext = Field(str)
+    ref_count = Field(int)
+
+    def __init__(self, sha1, ext, **kwargs):
+        """
+        :type sha1: str
+        :type ext: str
+        """
+        super(ThumbnailEntity, self).__init__(**kwargs)
+
+        self.sha1 = sha1
+        self.ext = ext
+
+    @property
+    def filename(self):
+        """
+        :rtype: str
+        :return: Path relative to the thumbnail folder, as stored on AssetEntity.thumbnail
+        """
+        return thumbnail_filename(self.sha1, self.ext)
+
+    @property
+    def path(self):
+        return os.path.join(settings.thumbs_folder, self.filename)
+
+    @classmethod
+    def store(cls, file_path):
+        """
+        Add a reference to the image, copying it into the thumbnail folder only if no asset uses the same image yet.
+
+        :type file_path: str
+        :rtype: ThumbnailEntity
+        """
+        return cls.add_references([cls.write(file_path)])[0]
+
+    @staticmethod
+    def write(file_path):
+        """
+        Copy the image into the thumbnail folder unless it is there already, without touching the database. Files
+        written for references that are never added are removed by collect_garbage.
+
+        :type file_path: str
+        :rtype: (str, str)
+        :return: sha1 and extension of the image
+        """
+        assert os.path.isfile(file_path), 'File does not exist %s' % file_path
+
+        ext = file_path.rsplit('.', 1)[-1].lower()
+        assert ext in EXTENSIONS, 'Only jpg, png or gif file types allowed for thumbnails.'
+
+        sha1 = file_sha1(file_path)
+        repo_path = os.path.join(settings.thumbs_folder, thumbnail_filename(sha1, ext))
+        if os.path.isfile(repo_path):
+            # The reference is added later, a release meanwhile leaves the file alone as long as it looks new
+            _touch(repo_path)
+        else:
+            # New image, or one lost from the share
+            folder = os.path.dirname(repo_path)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+            # Written under a temporary name so a reader never sees half a file under the final one
+            tmp_path = '%s.%s.tmp' % (repo_path, uuid.uuid4().hex)
+            shutil.copy(file_path, tmp_path)
+            try:
+                os.rename(tmp_path, repo_path)
+            except OSError:
+                # Windows does not rename over a file, another session stored the same image meanwhile
+                os.remove(tmp_path)
+                if not os.path.isfile(repo_path):
+                    raise
+            generate_variants(repo_path)
+
+        return sha1, ext
+
+    @classmethod
+    def add_references(cls, images):
+        """
+        Add one reference per image to the records of images already written, creating the missing records.
+        Counts are changed by the database so importers running at once do not lose each other's references.
+
+        :type images: list[(str, str)]
+        :param images: sha1 and extension of each image, as returned by write
+        :rtype: list[ThumbnailEntity]
+        :return: The record of each image, in the same order
+        """
+        counts = Counter(sha1 for sha1, _ in images)
+        if not counts:
+            return list()
+
+        engine = get_engine()
+        extensions = dict(images)
+        engine.create_missing([ThumbnailEntity(sha1, extensions[sha1]) for sha1 in sorted(counts)], 'sha1')
+        engine.increment(cls.NAME, 'ref_count', 'sha1', counts)
+
+        by_sha1 = dict((_.sha1, _) for _ in engine.select(Query(cls.NAME, sha1=list(counts))))
+        return [by_sha1[sha1] for sha1, _ in images]
+
+    @classmethod
+    def release(cls, filenames):
+        """
+        Drop one reference per filename, removing the images no asset uses anymore.
+
+        :type filenames: list[str]
+        :param filenames: AssetEntity.thumbnail values, names not in the store are removed from disk as they are
+        """
+        counts = Counter(_ for _ in filenames if _)
+        if not counts:
+            return
+
+        amounts = Counter()
+        for name, count in counts.items():
+            if _sha1(name) is not None:
+                amounts[_sha1(name)] -= count
+
+        engine = get_engine()
+        engine.increment(cls.NAME, 'ref_count', 'sha1', amounts, minimum=0)
+        records = engine.select(Query(cls.NAME, sha1=list(amounts))) if amounts else list()
+
+        # Thumbnails written before the store was introduced belong to a single asset
+        known = set(_.sha1 for _ in records)
+        for name in counts:
+            if _sha1(name) not in known:
+                _remove_file(os.path.join(settings.thumbs_folder, name))
+
+        cls._collect([_ for _ in records if not _.ref_count])
+
+    @classmethod
+    def collect_garbage(cls):
+        """
+        Recount the references of every stored image from the assets, remove the ones nothing points at and the
+        hash named files the database does not know about.
+
+        Counts and references are read by one statement and only the difference is written, references added by
+        importers running meanwhile are kept.
+
+        :rtype: dict[str,int]
+        :return: Number of images kept, removed and orphan files removed
+        """
+        engine = get_engine()
+
+        rows = engine.count_references(cls.NAME, 'sha1', 'ref_count', 'asset', 'thumbnail', _FILENAME_SQL)
+        engine.increment(cls.NAME, 'ref_count', 'sha1',
+                         dict((sha1, counted - (stored or 0)) for sha1, stored, counted in rows
+                              if counted != (stored or 0)))
+
+        records = list(engine.iter_select(Query(cls.NAME)))
+        removed = cls._collect([_ for _ in records if not _.ref_count])
+
+        # Files left behind by an interrupted store or a failed removal
+        known = set(_.sha1 for _ in records)
+        min_mtime = time.time() - ORPHAN_AGE
+        orphans = 0
+        for folder_name in os.listdir(settings.thumbs_folder):
+            folder = os.path.join(settings.thumbs_folder, folder_name)
+            if len(folder_name) != 2 or not os.path.isdir(folder):
+                continue
+            for file_name in os.listdir(folder):
+                file_path = os.path.join(folder, file_name)
+                sha1 = file_name.split('.', 1)[0].split('_', 1)[0]
+                if (sha1 not in known or file_name.endswith('.tmp')) and os.path.getmtime(file_path) < min_mtime:
+                    _remove_file(file_path, variants=False)
+                    orphans += 1
+
+        counts = dict(kept=len(records) - removed, removed=removed, orphans=orphans)
+        LOG.info('Thumbnail store: %(kept)d kept, %(removed)d removed, %(orphans)d orphan files removed.' % counts)
+        return counts
+
+    @classmethod
+    def _collect(cls, records):
+        """
+        Remove images with no references left, checking the assets first as several sessions share the counts.
+        Records are only deleted while their count is still zero, and files only once their record is gone and
+        no session wrote them lately, an importer may be about to reference them again.
+
+        :type records: list[ThumbnailEntity]
+        :rtype: int
+        :return: Number of images removed
+        """
+        engine = get_engine()
+        removed = 0
+        min_mtime = time.time() - ORPHAN_AGE
+        for i in range(0, len(records), _COLLECT_BATCH_SIZE):
+            batch = records[i:i + _COLLECT_BATCH_SIZE]
+            in_use = set(_.thumbnail for _ in engine.select(Query('asset', thumbnail=[_.filename for _ in batch])))
+            deleted = engine.delete_if([_ for _ in batch if _.filename not in in_use], 'ref_count', 0)
+            for record in deleted:
+                if _mtime(record.path) < min_mtime:
+                    _remove_file(record.path)
+            removed += len(deleted)
+        return removed
+
+
+def thumbnail_filename(sha1, ext):
+    """
+    :type sha1: str
+    :type ext: str
+    :rtype: str
+    :return: Path of a stored image relative to the thumbnail folder
+    """
+    return '%s/%s.%s' % (sha1[:2], sha1, ext)
+
+
+def file_sha1(file_path):
+    """
+    :type file_path: str
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sha1(filename):
+    """
+    :type filename: str
+    :rtype: str or None
+    :return: Hash part of a stored thumbnail name, None for thumbnails from before the store
+    """
+    name = os.path.basename(filename.replace('\\', '/')).split('.', 1)[0]
+    if len(name) != 40 or filename.replace('\\', '/').count('/') != 1:
+        return None
+    return name
+
+
+def _mtime(path):
+    """
+    :type path: str
+    :rtype: float
+    :return: 0 for a missing file
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def _touch(path):
+    try:
+        os.utime(path, None)
+    except OSError as e:
+        LOG.warning('Could not touch thumbnail %s: %s' % (path, e))
+
+
+def _remove_file(path, variants=True):
+    if os.path.isfile(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            LOG.warning('Could not remove thumbnail %s: %s' % (path, e))
+    if variants:
+        remove_variants(path)
@@ -5,13 +5,19 @@ class Field(object):
     _ORDER = 0
     ALLOWED_TYPES = (str, int, float, datetime.date, datetime.datetime)
 
-    def __init__(self, field_type):
+    def __init__(self, field_type, index=False, unique=False):
         """
         :type field_type: data type
         :param field_type: Any one of (str, int, float, datetime.date, datetime.datetime)
+        :type index: bool
+        :param index: Create an index on the column when the entity is set up
+        :type unique: bool
+        :param unique: Create a unique index on the column when the entity is set up
         """
         self.name = None
         self.type = field_type
+        self.index = index or unique
+        self.unique = unique
         self.order = Field._ORDER
         Field._ORDER += 1
 
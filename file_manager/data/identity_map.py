@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+
+from ..config import settings
+
+
+class IdentityMap(object):
+    """
+    Session wide cache of loaded entities keyed by (table, id) so looking up a record by id does not
+    need a round trip. Cached entities are never modified by the map, a record loaded again replaces
+    the cached object, so holders of the previous object on other threads are never changed under them.
+
+    Entries older than ttl seconds are treated as missing, which keeps multi-user setups from serving
+    stale rows forever. The map is bounded to max_size entries, evicting the least recently used.
+    """
+
+    def __init__(self, ttl=None, max_size=100000):
+        """
+        :type ttl: float or None
+        :param ttl: Seconds an entry stays valid, None keeps entries until invalidated
+        :type max_size: int
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._entries = OrderedDict()  # OrderedDict[(str, int), (BaseEntity, float)]
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, table, record_id):
+        """
+        :rtype: file_manager.data.entities.base_entity.BaseEntity or None
+        """
+        found, _ = self.get_many(table, [record_id])
+        return found.get(record_id)
+
+    def get_many(self, table, ids):
+        """
+        :type table: str
+        :type ids: collections.Iterable[int]
+        :rtype: (dict[int,file_manager.data.entities.base_entity.BaseEntity], list[int])
+        :return: Cached entities by id and the ids that have to be loaded
+        """
+        found = dict()
+        missing = list()
+        now = time.time()
+        with self._lock:
+            for record_id in ids:
+                if record_id in found:
+                    continue
+                entity = self._lookup((table, record_id), now)
+                if entity is None:
+                    missing.append(record_id)
+                else:
+                    found[record_id] = entity
+            self._hits += len(found)
+            self._misses += len(missing)
+        return found, missing
+
+    def merge(self, entities):
+        """
+        Register freshly loaded entities, they replace the cached objects of their records. A cached object
+        with unsaved changes is kept and handed back instead so the changes are not lost.
+
+        :type entities: list[file_manager.data.entities.base_entity.BaseEntity]
+        :rtype: list[file_manager.data.entities.base_entity.BaseEntity]
+        """
+        result = list()
+        now = time.time()
+        with self._lock:
+            for entity in entities:
+                key = (entity.NAME, entity.id)
+                cached = self._lookup(key, now)
+                if cached is not None and type(cached) is type(entity) and cached.changes():
+                    self._entries[key] = (cached, now)
+                    result.append(cached)
+                    continue
+
+                self._entries[key] = (entity, now)
+                result.append(entity)
+
+            self._trim()
+        return result
+
+    def add(self, entity):
+        """
+        Make the entity the cached object for its record, replacing any other object.
+        """
+        with self._lock:
+            key = (entity.NAME, entity.id)
+            self._entries.pop(key, None)
+            self._entries[key] = (entity, time.time())
+            self._trim()
+
+    def invalidate(self, table, ids):
+        """
+        :type table: str
+        :type ids: collections.Iterable[int]
+        """
+        with self._lock:
+            for record_id in ids:
+                self._entries.pop((table, record_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :rtype: dict[str,int]
+        """
+        with self._lock:
+            return dict(hits=self._hits, misses=self._misses, size=len(self._entries))
+
+    def _lookup(self, key, now):
+        """
+        Must be called while holding the lock.
+        """
+        item = self._entries.pop(key, None)
+        if item is None:
+            return None
+
+        entity, loaded = item
+        if self.ttl and now - loaded > self.ttl:
+            return None
+
+        # Re-insert to mark as most recently used
+        self._entries[key] = item
+        return entity
+
+    def _trim(self):
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+IDENTITY_MAP = IdentityMap(ttl=settings.identity_map_ttl, max_size=settings.identity_map_size)
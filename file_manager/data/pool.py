@@ -0,0 +1,187 @@
+import threading
+import time
+
+from ..config import LOG
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Thread safe pool of long lived database connections.
+
+    Connections are created lazily by the factory up to max_size, kept open between borrows and
+    closed again once they have been idle longer than idle_timeout (never dropping below min_size).
+    """
+
+    def __init__(self, factory, min_size=1, max_size=10, idle_timeout=300, wait_timeout=30, check_interval=30,
+                 health_check=None):
+        """
+        :type factory: callable
+        :param factory: Callable returning a new connection
+        :type min_size: int
+        :param min_size: Number of connections kept open even when idle
+        :type max_size: int
+        :param max_size: Maximum number of connections open at the same time
+        :type idle_timeout: float
+        :param idle_timeout: Seconds an idle connection is kept before being closed
+        :type wait_timeout: float
+        :param wait_timeout: Seconds to wait for a free connection before raising PoolTimeout
+        :type check_interval: float
+        :param check_interval: Connections idle longer than this are health checked before being handed out
+        :type health_check: callable
+        :param health_check: Callable taking a connection and returning False (or raising) if it is unusable
+        """
+        assert max_size > 0, 'Pool max_size must be greater than 0.'
+        assert min_size <= max_size, 'Pool min_size cannot be greater than max_size.'
+
+        self._factory = factory
+        self._health_check = health_check
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.check_interval = check_interval
+
+        self._idle = list()  # list[(connection, released_time)], most recently used last
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+
+        self._stats = dict(hits=0, waits=0, created=0, closed=0, failed_checks=0)
+
+    def acquire(self):
+        """
+        Borrow a connection from the pool, creating one if none are idle and the pool is not full.
+        """
+        deadline = None
+        with self._cond:
+            while True:
+                assert not self._closed, 'Connection pool has been closed.'
+                self._reap_idle()
+
+                if self._idle:
+                    conn, released = self._idle.pop()
+                    self._in_use += 1
+                    break
+
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    conn, released = None, None
+                    break
+
+                if deadline is None:
+                    self._stats['waits'] += 1
+                    deadline = time.time() + self.wait_timeout
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout('Timed out waiting %ss for a database connection.' % self.wait_timeout)
+                self._cond.wait(remaining)
+
+        try:
+            if conn is not None and time.time() - released > self.check_interval and not self._is_healthy(conn):
+                self._close(conn)
+                with self._cond:
+                    self._stats['failed_checks'] += 1
+                    self._stats['closed'] += 1
+                conn = None
+
+            if conn is None:
+                conn = self._factory()
+                with self._cond:
+                    self._stats['created'] += 1
+            else:
+                with self._cond:
+                    self._stats['hits'] += 1
+        except:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Return a borrowed connection to the pool.
+
+        :type discard: bool
+        :param discard: Close the connection instead of returning it, used when it is known to be broken
+        """
+        if discard or self._closed or getattr(conn, 'closed', False):
+            self._close(conn)
+            with self._cond:
+                self._in_use -= 1
+                self._stats['closed'] += 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time.time()))
+            self._reap_idle()
+            self._cond.notify()
+
+    def close(self):
+        """
+        Close all idle connections, connections still in use are closed when released.
+        """
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = list()
+            self._cond.notify_all()
+
+        for conn, _ in idle:
+            self._close(conn)
+
+        with self._cond:
+            self._stats['closed'] += len(idle)
+
+    def stats(self):
+        """
+        :rtype: dict[str,int]
+        :return: Counters for pool hits, waits and new connections along with the current pool size
+        """
+        with self._cond:
+            result = dict(self._stats)
+            result['idle'] = len(self._idle)
+            result['in_use'] = self._in_use
+        return result
+
+    def _is_healthy(self, conn):
+        if getattr(conn, 'closed', False):
+            return False
+        if self._health_check is None:
+            return True
+        try:
+            return self._health_check(conn) is not False
+        except Exception as e:
+            LOG.debug('Pooled connection failed health check: %s' % e)
+            return False
+
+    def _reap_idle(self):
+        """
+        Close connections idle longer than idle_timeout, must be called while holding the lock.
+        """
+        if not self.idle_timeout:
+            return
+
+        now = time.time()
+        # Least recently used connections are at the front of the list
+        while self._idle and len(self._idle) + self._in_use > self.min_size:
+            conn, released = self._idle[0]
+            if now - released < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._close(conn)
+            self._stats['closed'] += 1
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
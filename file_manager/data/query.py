@@ -1,5 +1,7 @@
 import re
 import sys
+import threading
+from collections import OrderedDict
 
 if sys.version_info[0] > 2:
     _string_types = str,
@@ -15,6 +17,15 @@ class Query(object):
         POSTGRES = 'postgresql'
         SQLITE = 'SQLITE'
 
+        @staticmethod
+        def placeholder(language):
+            """
+            Bound parameter marker for the paramstyle of the language's driver.
+            """
+            if language == Query.DBLANG.SQLITE:
+                return '?'
+            return '%s'
+
     class OP(object):
         EQ = '='
         OR = 'OR'
@@ -65,6 +76,7 @@ class Query(object):
     """
 
     DEFAULT_LANG = None
+    CACHE_SIZE = 512  # Number of compiled statements kept by build_query
 
     def __init__(self, table_name, **filters):
         self._where_filter_group_stack = []
@@ -186,10 +198,59 @@ class Query(object):
         self._where_filter_group_stack.append(filter_group)
         return self
 
-    def build_query(self, language):
+    def build_query(self, language, parameterize=False):
+        """
+        :type language: str
+        :type parameterize: bool
+        :param parameterize: Return (statement, params) with placeholders instead of inlined literals
+        :rtype: str or (str, list)
+        """
+        if parameterize:
+            key = self.shape(language)
+            statement = _COMPILED_CACHE.get(key)
+            if statement is not None:
+                params = list()
+                self._where_statement.get_params(language, params)
+                return statement, params
+
+            statement, params = self._compile(language, list())
+            _COMPILED_CACHE.put(key, statement)
+            return statement, params
+
+        return self._compile(language, None)[0]
+
+    @staticmethod
+    def cache_stats():
+        """
+        :rtype: dict[str,int]
+        :return: Hits, misses, evictions and size of the compiled statement cache
+        """
+        return _COMPILED_CACHE.stats()
+
+    @staticmethod
+    def clear_cache():
+        _COMPILED_CACHE.clear()
+
+    def shape(self, language):
+        """
+        Hashable description of everything that affects the parameterized statement text,
+        queries with the same shape only differ in their bound values.
+
+        :rtype: tuple
+        """
+        return (language,
+                tuple(self._select_statement.columns),
+                self._from_statement.table,
+                self._where_statement.shape(language),
+                tuple(self._group_by_statement.columns()),
+                tuple(self._order_by_statement.get_pairs()),
+                self._limit_statement.limit if self._limit_statement.is_valid() else None,
+                self._offset_statement.offset if self._offset_statement.is_valid() else None)
+
+    def _compile(self, language, params):
         statement = self._select_statement.get_string()
         statement += self._from_statement.get_string()
-        statement += self._where_statement.get_string(language)
+        statement += self._where_statement.get_string(language, params)
 
         if self._group_by_statement.is_valid():
             statement += self._group_by_statement.get_string()
@@ -197,13 +258,13 @@ class Query(object):
         if self._order_by_statement.is_valid():
             statement += self._order_by_statement.get_string()
 
-        if self._limit_statement.is_valid:
+        if self._limit_statement.is_valid():
             statement += self._limit_statement.get_string()
 
-        if self._offset_statement.is_valid:
+        if self._offset_statement.is_valid():
             statement += self._offset_statement.get_string()
 
-        return statement
+        return statement, params
 
     def columns(self):
         return self._select_statement.columns
@@ -215,6 +276,58 @@ class Query(object):
     def get_where_string(self, language):
         return self._where_statement.get_string(language)
 
+    def id_lookup(self):
+        """
+        :rtype: list or None
+        :return: The ids being fetched when the query only filters on id, otherwise None
+        """
+        if self._group_by_statement.is_valid() or self._order_by_statement.is_valid():
+            return None
+        if self._limit_statement.is_valid() or self._offset_statement.is_valid():
+            return None
+
+        filter_group = self._where_statement.filter_group
+        if filter_group is None or filter_group.operator() != Query.OP.AND:
+            return None
+
+        filters = [fo for fo in filter_group.filters() if fo]
+        if len(filters) != 1 or not isinstance(filters[0], Filter) or filters[0].lvalue != 'id':
+            return None
+
+        id_filter = filters[0]
+        if id_filter.operator == Query.OP.EQ:
+            return [id_filter.rvalue]
+        if id_filter.operator == Query.OP.ISIN:
+            return list(id_filter.rvalue)
+        return None
+
+    def seek_after(self, column, after=None):
+        """
+        Keyset pagination, order by column then id and only return rows that come after the given position.
+        Rows where column is NULL are never returned since they cannot be placed in the ordering.
+
+        :type column: str
+        :type after: (variant, int) or None
+        :param after: (column value, id) of the last row of the previous page, None for the first page
+        """
+        self.add_order_by(column, Query.ORDER.ASC)
+        self.add_order_by('id', Query.ORDER.ASC)
+
+        seek_group = FilterGroup(Query.OP.AND)
+        seek_group.add_filters(Filter(column, operator=Query.OP.ISNOTNULL))
+        if after is not None:
+            value, last_id = after
+            tie_group = FilterGroup(Query.OP.AND)
+            tie_group.add_filters(Filter(column, value), Filter('id', last_id, Query.OP.GT))
+            after_group = FilterGroup(Query.OP.OR)
+            after_group.add_filters(Filter(column, value, Query.OP.GT))
+            after_group.add_filter_group(tie_group)
+            seek_group.add_filter_group(after_group)
+
+        # Attach to the root group so the seek is ANDed with every other filter
+        self._where_statement.filter_group.add_filter_group(seek_group)
+        return self
+
     def set_limit(self, limit):
         self._limit_statement.set_limit(limit)
         return self
@@ -248,12 +361,18 @@ class Filter(object):
     def __str__(self):
         return str((self.lvalue, self.operator, self.rvalue, self.match_case))
 
-    def _format_filter(self, language):
+    def _format_filter(self, language, params=None):
         operator = Query.OP.get(language, self.operator, self.match_case)
 
         # FORMAT LVALUE
         lvalue = str(self.lvalue)
 
+        if self.operator in (Query.OP.ISNULL, Query.OP.ISNOTNULL):
+            return lvalue + ' ' + operator
+
+        if params is not None:
+            return self._format_parameterized(language, lvalue, operator, params)
+
         # FORMAT RVALUE
         if self.rvalue is None:
             rvalue = None
@@ -263,14 +382,53 @@ class Filter(object):
                 fixed_vals.append(str(v).replace("'", "''"))
             rvalue = "('%s')" % "', '".join(fixed_vals)
         else:
-            rvalue = "'%s'" % str(self.rvalue).strip("'")
+            rvalue = "'%s'" % str(self.rvalue).strip("'").replace("'", "''")
+
+        return "%s %s %s" % (lvalue, operator, rvalue)
+
+    def _format_parameterized(self, language, lvalue, operator, params):
+        placeholder = Query.DBLANG.placeholder(language)
+
+        if self.operator in (Query.OP.ISIN, Query.OP.ISNIN):
+            values = list(self.rvalue)
+            if language == Query.DBLANG.POSTGRES:
+                # A single array parameter keeps the statement text the same for any number of values
+                params.append(values)
+                if self.operator == Query.OP.ISIN:
+                    return '%s = ANY(%s)' % (lvalue, placeholder)
+                return '%s <> ALL(%s)' % (lvalue, placeholder)
 
+            params.extend(values)
+            return '%s %s (%s)' % (lvalue, operator, ', '.join([placeholder] * len(values)))
+
+        params.append(self.rvalue)
+        return '%s %s %s' % (lvalue, operator, placeholder)
+
+    def get_params(self, language, params):
+        """
+        Append the bound values in the same order get_string would.
+        """
         if self.operator in (Query.OP.ISNULL, Query.OP.ISNOTNULL):
-            return lvalue + ' ' + operator
+            return
+        if self.operator in (Query.OP.ISIN, Query.OP.ISNIN):
+            if language == Query.DBLANG.POSTGRES:
+                params.append(list(self.rvalue))
+            else:
+                params.extend(self.rvalue)
+            return
+        params.append(self.rvalue)
 
-        return "%s %s %s" % (lvalue, operator, rvalue)
+    def shape(self, language):
+        count = None
+        if self.operator in (Query.OP.ISIN, Query.OP.ISNIN) and language != Query.DBLANG.POSTGRES:
+            count = len(self.rvalue)
+        return self.lvalue, self.operator, self.match_case, count
 
-    def get_string(self, language=None):
+    def get_string(self, language=None, params=None):
+        """
+        :type params: list or None
+        :param params: When given, values are appended to it and placeholders are written to the statement
+        """
         language = language or Query.DEFAULT_LANG
         assert language, 'No default launguage set on QueryBuilder.'
 
@@ -289,7 +447,7 @@ class Filter(object):
         # HAS LVALUE
         assert self.lvalue is not None, 'Left value cannot be NULL.'
 
-        return self._format_filter(language)
+        return self._format_filter(language, params)
 
 
 class _SelectStatement(object):
@@ -322,15 +480,24 @@ class _WhereStatement(object):
     def __init__(self):
         self.filter_group = None
 
-    def get_string(self, language):
+    def get_string(self, language, params=None):
         if not self.filter_group or not self.filter_group.has_filters():
             return ''
 
         statement = 'WHERE '
-        statement += self.filter_group.get_string(language)
+        statement += self.filter_group.get_string(language, params)
         statement += ' '
         return statement
 
+    def get_params(self, language, params):
+        if self.filter_group:
+            self.filter_group.get_params(language, params)
+
+    def shape(self, language):
+        if not self.filter_group or not self.filter_group.has_filters():
+            return None
+        return self.filter_group.shape(language)
+
 
 class FilterGroup(object):
     def __init__(self, operator):
@@ -349,6 +516,8 @@ class FilterGroup(object):
     def __nonzero__(self):
         return self.has_filters()
 
+    __bool__ = __nonzero__
+
     def add_filter(self, lvalue, rvalue=None, operator=Query.OP.EQ, match_case=True):
         if isinstance(lvalue, _string_types) and rvalue is None and operator in (Query.OP.EQ, Query.OP.NEQ):
             operator = Query.OP.ISNULL if operator == Query.OP.EQ else Query.OP.ISNOTNULL
@@ -375,16 +544,30 @@ class FilterGroup(object):
     def add_filter_group(self, filter_group):
         self._filters.append(filter_group)
 
-    def get_string(self, language):
+    def get_string(self, language, params=None):
         statement = '( '
         op = ' ' + self._operator + ' '
-        statement += op.join(fo.get_string(language) for fo in self._filters if fo)
+        statement += op.join(fo.get_string(language, params) for fo in self._filters if fo)
         statement += ' )'
         return statement
 
+    def get_params(self, language, params):
+        for fo in self._filters:
+            if fo:
+                fo.get_params(language, params)
+
+    def shape(self, language):
+        return self._operator, tuple(fo.shape(language) for fo in self._filters if fo)
+
+    def filters(self):
+        return self._filters
+
     def has_filters(self):
         return any([x for x in self._filters])
 
+    def operator(self):
+        return self._operator
+
 
 class _GroupByStatement(object):
     def __init__(self):
@@ -393,6 +576,9 @@ class _GroupByStatement(object):
     def add_column(self, column):
         self._columns.append(column)
 
+    def columns(self):
+        return self._columns
+
     def is_valid(self):
         return bool(self._columns)
 
@@ -444,17 +630,17 @@ class _OrderByStatement(object):
 class _OffsetStatement(object):
     def __init__(self):
         self.offset = 0
-        self.is_valid = False
+        self._valid = False
 
     def is_valid(self):
-        return self.is_valid
+        return self._valid
 
     def set_offset(self, limit):
         self.offset = limit
-        self.is_valid = True
+        self._valid = True
 
     def set_valid(self, valid):
-        self.is_valid = valid
+        self._valid = valid
 
     def get_string(self):
         return 'OFFSET %s ' % self.offset
@@ -463,11 +649,57 @@ class _OffsetStatement(object):
 class _LimitStatement(object):
     def __init__(self):
         self.limit = 0
-        self.is_valid = False
+        self._valid = False
+
+    def is_valid(self):
+        return self._valid
 
     def set_limit(self, limit):
         self.limit = limit
-        self.is_valid = True
+        self._valid = True
 
     def get_string(self):
         return 'LIMIT %s ' % self.limit
+
+
+class _CompiledQueryCache(object):
+    """
+    Thread safe LRU of statement text keyed by Query.shape, bounded by Query.CACHE_SIZE.
+    """
+
+    def __init__(self):
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            statement = self._statements.pop(key, None)
+            if statement is None:
+                self._misses += 1
+                return None
+            self._statements[key] = statement
+            self._hits += 1
+            return statement
+
+    def put(self, key, statement):
+        with self._lock:
+            self._statements.pop(key, None)
+            self._statements[key] = statement
+            while len(self._statements) > Query.CACHE_SIZE:
+                self._statements.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self._hits, misses=self._misses, evictions=self._evictions, size=len(self._statements))
+
+
+_COMPILED_CACHE = _CompiledQueryCache()
@@ -26,6 +26,9 @@ def _maya_main_window():
 
 
 def run_maya():
+    # Pool processes would start another Maya, template hooks run inside this one
+    settings.template_processes = 0
+
     # Install
     from file_manager.data.connection import get_engine
     from file_manager.data.entities import *
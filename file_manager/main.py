@@ -1,12 +1,20 @@
 import os
 
 from Qt import QtCore, QtWidgets
-from . import apply_default_color_scheme, FileManagerApp, settings
-
-app = QtWidgets.QApplication([])
-apply_default_color_scheme()
-ui = FileManagerApp()
-settings.main_ui = ui
-ui.resize(1600, 900)
-ui.show()
-app.exec_()
+# Absolute, template hook workers on Windows load this file again outside of its package
+from file_manager import apply_default_color_scheme, FileManagerApp, settings
+
+
+def main():
+    app = QtWidgets.QApplication([])
+    apply_default_color_scheme()
+    ui = FileManagerApp()
+    settings.main_ui = ui
+    ui.resize(1600, 900)
+    ui.show()
+    app.exec_()
+
+
+# Those workers load it as __parents_main__ (__mp_main__ on python 3), they must not start the application
+if __name__ not in ('__parents_main__', '__mp_main__'):
+    main()
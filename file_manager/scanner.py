@@ -0,0 +1,209 @@
+import fnmatch
+import os
+import re
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Backport for python 2, pip install scandir
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .config import settings, LOG
+
+
+def scan(root_path, extensions=None, excludes=None, workers=None, progress=None, progress_interval=0.25,
+         cancelled=None, snapshot=None):
+    """
+    Find the files below root_path, listing several folders at once.
+
+    Every folder is a job for a pool of worker threads, sub folders found while listing are queued for the pool.
+    Listing a folder on a network share is mostly waiting on the server, so a few folders in flight at a time
+    hide most of that latency. Symlinked folders are not followed and unreadable folders are skipped, like os.walk.
+
+    With a snapshot of a previous scan, folders whose mtime did not change are not listed, their sub folders are
+    taken from the snapshot, and only new or changed files are returned. The snapshot is updated as folders are
+    listed and written when its commit is called.
+
+    :type root_path: str
+    :type extensions: list[str]
+    :param extensions: File extensions to keep, with or without the dot, all files if empty
+    :type excludes: list[str]
+    :param excludes: Glob patterns matched against file and folder names, or against the path from root_path
+        when the pattern contains a /, excluded folders are not entered
+    :type workers: int
+    :param workers: Number of folders listed at once, defaults to scan_workers in settings.ini
+    :type progress: callable
+    :param progress: Called with the number of folders listed and files found so far, at most every
+        progress_interval seconds, from a worker thread
+    :type progress_interval: float
+    :type cancelled: callable
+    :param cancelled: Polled by the workers, the scan stops early when it returns True
+    :type snapshot: file_manager.snapshot.Snapshot
+    :rtype: list[str]
+    :return: Sorted file paths with forward slashes
+    """
+    root_path = root_path.replace('\\', '/').rstrip('/')
+    suffixes = tuple('.' + x.strip().lstrip('.').lower() for x in extensions or list() if x.strip())
+    name_match, path_match = _compile_excludes(excludes)
+    workers = max(1, workers or settings.scan_workers)
+
+    found = list()
+    state = dict(folders=0, last_progress=0.0)
+    lock = threading.Lock()
+    jobs = queue.Queue()
+
+    def _list_folder(folder):
+        files = list()
+        sub_folders = list()
+        for name, is_dir, _ in _list(folder):
+            path = folder + '/' + name
+            if name_match(name) or path_match(path[len(root_path) + 1:]):
+                continue
+            if is_dir:
+                sub_folders.append(path)
+            elif not suffixes or name.lower().endswith(suffixes):
+                files.append(path)
+        return files, sub_folders
+
+    def _list_changes(folder):
+        mtime = os.stat(folder).st_mtime
+        names = snapshot.sub_folders(folder, mtime)
+        if names is not None:
+            return list(), [folder + '/' + name for name in names]
+
+        known = snapshot.files(folder)
+        listed = dict()
+        files = list()
+        sub_folders = list()
+        wanted = lambda n: (not suffixes or n.lower().endswith(suffixes)) and not name_match(n)
+        for name, is_dir, stat in _list(folder, stat=wanted):
+            path = folder + '/' + name
+            if name_match(name) or path_match(path[len(root_path) + 1:]):
+                continue
+            if is_dir:
+                sub_folders.append(path)
+            elif stat is not None:
+                listed[name] = (stat.st_size, stat.st_mtime, stat.st_ino)
+                if known.get(name) != listed[name]:
+                    files.append(path)
+
+        snapshot.record(folder, mtime, [_.rsplit('/', 1)[-1] for _ in sub_folders], listed)
+        return files, sub_folders
+
+    def _scan_folder(folder):
+        files = list()
+        sub_folders = list()
+        try:
+            files, sub_folders = _list_folder(folder) if snapshot is None else _list_changes(folder)
+        except OSError as e:
+            LOG.debug('Could not list %s: %s' % (folder, e))
+
+        for sub_folder in sub_folders:
+            jobs.put(sub_folder)
+
+        with lock:
+            found.extend(files)
+            state['folders'] += 1
+            now = time.time()
+            report = progress and now - state['last_progress'] >= progress_interval
+            if report:
+                state['last_progress'] = now
+                counts = state['folders'], len(found)
+        if report:
+            progress(*counts)
+
+    def _work():
+        while True:
+            folder = jobs.get()
+            try:
+                if folder is not None and not (cancelled and cancelled()):
+                    _scan_folder(folder)
+            finally:
+                jobs.task_done()
+            if folder is None:
+                return
+
+    threads = [threading.Thread(target=_work, name='scan-%d' % i) for i in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    # Every listed folder queues its sub folders before it is marked done, join returns once the tree is listed
+    jobs.put(root_path)
+    jobs.join()
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+
+    if progress:
+        progress(state['folders'], len(found))
+
+    found.sort()
+    return found
+
+
+def _list(folder, stat=None):
+    """
+    :type folder: str
+    :type stat: callable
+    :param stat: Called with the name of each file, its stat is returned when this returns True
+    :rtype: collections.Iterable[(str, bool, os.stat_result or None)]
+    :return: Name of each entry, whether it is a folder and the stat of files that asked for it, symlinks to folders
+        count as files
+    """
+    if scandir is not None:
+        # The type comes with the listing on Windows and most unix file systems, no stat per entry. On Windows the
+        # size and mtime come with it too but the inode is left at 0.
+        for entry in scandir(folder):
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            yield entry.name, is_dir, _stat(entry.stat) if not is_dir and stat and stat(entry.name) else None
+        return
+
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        is_dir = os.path.isdir(path) and not os.path.islink(path)
+        yield name, is_dir, _stat(os.stat, path) if not is_dir and stat and stat(name) else None
+
+
+def _stat(func, *args):
+    try:
+        return func(*args)
+    except OSError:
+        # Removed while listing or a broken link
+        return None
+
+
+def _compile_excludes(excludes):
+    """
+    :type excludes: list[str]
+    :rtype: (callable, callable)
+    :return: Matchers for an entry name and for the path relative to the scanned root
+    """
+    names = list()
+    paths = list()
+    for pattern in excludes or list():
+        pattern = pattern.strip().replace('\\', '/').strip('/')
+        if pattern:
+            (paths if '/' in pattern else names).append(fnmatch.translate(pattern))
+
+    # Windows and the NAS shares are case insensitive
+    def _matcher(patterns):
+        if not patterns:
+            return lambda value: False
+        return re.compile('|'.join('(?:%s)' % _ for _ in patterns), re.IGNORECASE).match
+
+    return _matcher(names), _matcher(paths)
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .config import settings, LOG
+
+MTIME_RESOLUTION = 2.0  # Seconds, folders changed this recently are listed again next time as well (FAT, SMB)
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY NOT NULL, mtime REAL, sub_folders TEXT)',
+    'CREATE TABLE IF NOT EXISTS files (folder TEXT NOT NULL, name TEXT NOT NULL, size INTEGER, mtime REAL, '
+    'inode INTEGER, PRIMARY KEY (folder, name))',
+)
+
+
+class Snapshot(object):
+    """
+    What an import of a folder tree saw last time: the mtime and sub folders of every folder and the size, mtime
+    and inode of every matching file, kept in a sqlite file next to the other snapshots.
+
+    Adding, removing or renaming an entry changes the mtime of the folder holding it, so the scanner only lists
+    folders whose mtime changed and only returns the files that are new or changed in those. Unchanged folders cost
+    one stat. Changes found while scanning are kept aside until commit, which is called once the database holds
+    every path the scan returned.
+
+    A snapshot belongs to a root path, extensions, excludes and template, changing any of those starts a new one.
+    Editing the template counts as a change, its is_valid may accept files it skipped before.
+    """
+
+    def __init__(self, root_path, extensions=None, excludes=None, template=None, reset=False):
+        """
+        :type root_path: str
+        :type extensions: list[str]
+        :type excludes: list[str]
+        :type template: str
+        :param template: Path of the template filtering the files, its content is part of the key
+        :type reset: bool
+        :param reset: Ignore what was seen before, every folder is listed and every file returned
+        """
+        self.root_path = root_path.replace('\\', '/').rstrip('/')
+        key = '|'.join([self.root_path,
+                        ','.join(sorted(x.strip().lstrip('.').lower() for x in extensions or list())),
+                        ','.join(sorted(x.strip() for x in excludes or list())),
+                        _template_key(template)])
+        self.path = os.path.join(settings.snapshot_folder, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.sqlite')
+
+        self._lock = threading.Lock()
+        self._folders = dict()  # dict[str,(float, list[str])] mtime and sub folder names by folder path
+        self._visited = set()  # set[str] folders the scan accounted for
+        self._changed = dict()  # dict[str,(float, list[str], dict[str,(int, float, int)])] folders listed again
+
+        self._conn = None
+        if not reset and os.path.isfile(self.path):
+            self._conn = self._connect()
+            for path, mtime, sub_folders in self._conn.execute('SELECT path, mtime, sub_folders FROM folders'):
+                self._folders[path] = (mtime, sub_folders.split('\n') if sub_folders else list())
+
+    def __len__(self):
+        return len(self._folders)
+
+    def sub_folders(self, folder, mtime):
+        """
+        :type folder: str
+        :type mtime: float
+        :rtype: list[str] or None
+        :return: Names of the sub folders if the folder did not change since the snapshot, None if it has to be listed
+        """
+        known = self._folders.get(folder)
+        if known is None or known[0] != mtime:
+            return None
+
+        with self._lock:
+            self._visited.add(folder)
+        return known[1]
+
+    def files(self, folder):
+        """
+        :type folder: str
+        :rtype: dict[str,(int, float, int)]
+        :return: Size, mtime and inode of the files of the folder by name
+        """
+        if self._conn is None or folder not in self._folders:
+            return dict()
+
+        with self._lock:
+            rows = self._conn.execute('SELECT name, size, mtime, inode FROM files WHERE folder = ?', (folder,))
+            return dict((row[0], tuple(row[1:])) for row in rows.fetchall())
+
+    def record(self, folder, mtime, sub_folders, files):
+        """
+        Remember a folder that was listed again, written on commit.
+
+        :type folder: str
+        :type mtime: float
+        :type sub_folders: list[str]
+        :type files: dict[str,(int, float, int)]
+        """
+        if mtime > time.time() - MTIME_RESOLUTION:
+            # An entry added later within the same mtime tick would not change it
+            mtime = None
+
+        with self._lock:
+            self._visited.add(folder)
+            self._changed[folder] = (mtime, sub_folders, files)
+
+    def stats(self):
+        """
+        :rtype: dict[str,int]
+        """
+        with self._lock:
+            return dict(folders=len(self._visited), listed=len(self._changed),
+                        removed=len(set(self._folders) - self._visited))
+
+    def commit(self):
+        """
+        Write the folders listed during the scan and drop the ones that were not seen anymore.
+        """
+        removed = [(_,) for _ in set(self._folders) - self._visited]
+        changed = list(self._changed.items())
+
+        if self._conn is None:
+            if not os.path.isdir(settings.snapshot_folder):
+                os.makedirs(settings.snapshot_folder)
+            if os.path.isfile(self.path):
+                # Reset, start from an empty file
+                os.remove(self.path)
+            self._conn = self._connect()
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('DELETE FROM folders WHERE path = ?', removed)
+                self._conn.executemany('DELETE FROM files WHERE folder = ?', removed)
+                self._conn.executemany('DELETE FROM files WHERE folder = ?', [(path,) for path, _ in changed])
+                self._conn.executemany('INSERT OR REPLACE INTO folders (path, mtime, sub_folders) VALUES (?, ?, ?)',
+                                       [(path, mtime, '\n'.join(sub_folders))
+                                        for path, (mtime, sub_folders, _) in changed])
+                self._conn.executemany('INSERT INTO files (folder, name, size, mtime, inode) VALUES (?, ?, ?, ?, ?)',
+                                       [(path, name, size, file_mtime, inode)
+                                        for path, (_, _, files) in changed
+                                        for name, (size, file_mtime, inode) in files.items()])
+
+        LOG.info('Snapshot of %s: %d folders, %d listed again, %d removed.' %
+                 (self.root_path, len(self._visited), len(self._changed), len(removed)))
+
+        for path, (mtime, sub_folders, _) in changed:
+            self._folders[path] = (mtime, sub_folders)
+        for (path,) in removed:
+            del self._folders[path]
+        self._visited.clear()
+        self._changed.clear()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        return conn
+
+
+def _template_key(template):
+    """
+    :type template: str
+    :rtype: str
+    :return: Path and content hash of the template, empty without one
+    """
+    if not template:
+        return ''
+    digest = hashlib.sha1()
+    if os.path.isfile(template):
+        with open(template, 'rb') as f:
+            digest.update(f.read())
+    return '%s@%s' % (os.path.normpath(template).replace('\\', '/'), digest.hexdigest())
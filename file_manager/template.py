@@ -1,8 +1,22 @@
 import hashlib
 import imp
+import multiprocessing
 import os
+import time
+import traceback
+from collections import OrderedDict, namedtuple
 
-from .config import settings
+try:
+    from multiprocessing import SimpleQueue as _SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue as _SimpleQueue
+
+from .config import settings, LOG
+
+TemplateResult = namedtuple('TemplateResult', 'path asset_name tags thumbnail error')
+
+_WORKER_TEMPLATE = None  # ParsingTemplate of a pool worker process, or why it could not be loaded
+_WORKER_STARTED = None  # SimpleQueue[(int, int)] of a pool worker process, index and pid of each file it starts
 
 
 class ParsingTemplate(object):
@@ -29,3 +43,202 @@ class ParsingTemplate(object):
         if self._mod and hasattr(self._mod, 'get_tags'):
             tags = self._mod.get_tags(file_path)
         return tags
+
+
+def resolve_paths(template_name, paths, processes=None, timeout=None, progress=None, cancelled=None):
+    """
+    Run the asset name, tags and thumbnail hooks of the template for every path.
+
+    Hooks run in a pool of processes, a thumbnail hook starting mayapy for each file is mostly waiting so several
+    files are worked on at once. Only as many files as there are processes are handed out at a time, a file whose
+    hooks run longer than timeout is failed and the pool is replaced to stop it, the files that were running next to
+    it are run again. A file whose worker process dies is failed right away. With processes at 0 the hooks run in
+    this process one file at a time, without timeouts, as needed inside applications whose executable can not start
+    a plain python process (Maya).
+
+    :type template_name: str
+    :type paths: list[str]
+    :type processes: int
+    :param processes: Defaults to template_processes in settings.ini
+    :type timeout: float
+    :param timeout: Seconds the hooks of one file may run, defaults to template_timeout in settings.ini, 0 to wait
+        forever
+    :type progress: callable
+    :param progress: Called with the number of files done and the total, from the calling thread
+    :type cancelled: callable
+    :param cancelled: Polled between files, the files not done are left out when it returns True
+    :rtype: list[TemplateResult]
+    :return: Result of each path in the same order, error holds the reason when the hooks failed
+    """
+    processes = settings.template_processes if processes is None else processes
+    timeout = settings.template_timeout if timeout is None else timeout
+
+    if processes <= 0:
+        return _resolve_inline(template_name, paths, progress, cancelled)
+    return _resolve_pooled(template_name, paths, processes, timeout, progress, cancelled)
+
+
+def _resolve_inline(template_name, paths, progress, cancelled):
+    template = ParsingTemplate(template_name)
+    results = list()
+    for i, path in enumerate(paths):
+        if cancelled and cancelled():
+            break
+        results.append(TemplateResult(path, *_run_hooks(template, path)))
+        if progress:
+            progress(i + 1, len(paths))
+    return results
+
+
+def _resolve_pooled(template_name, paths, processes, timeout, progress, cancelled):
+    results = [None] * len(paths)
+    waiting = list(range(len(paths)))  # Indexes not handed to the pool yet, next one last
+    waiting.reverse()
+    running = OrderedDict()  # OrderedDict[int, (float, AsyncResult)] start time and result of the files in the pool
+    done = 0
+
+    pool = _HookPool(template_name, processes)
+    try:
+        while waiting or running:
+            if cancelled and cancelled():
+                return [_ for _ in results if _ is not None]
+
+            while waiting and len(running) < processes:
+                index = waiting.pop()
+                running[index] = (time.time(), pool.apply(index, paths[index]))
+
+            finished = OrderedDict()  # OrderedDict[int, tuple] hook results by index, the first one counts
+            next(iter(running.values()))[1].wait(0.1)
+            for index, (_, result) in running.items():
+                if result.ready():
+                    try:
+                        finished[index] = result.get()
+                    except Exception as e:
+                        # The hooks returned something that can not be sent back from the worker
+                        finished[index] = None, None, None, 'Could not return the result: %s' % e
+
+            for index in pool.lost(list(running)):
+                LOG.warning('Template process died running the hooks on %s' % paths[index])
+                finished.setdefault(index, (None, None, None, 'Template process died'))
+
+            if pool.failing_to_start():
+                LOG.error('Template processes exit while starting, the hooks are not run.')
+                for index in list(running) + waiting:
+                    finished.setdefault(index, (None, None, None, 'Template processes could not start'))
+                del waiting[:]
+
+            for index, result in finished.items():
+                running.pop(index, None)
+                results[index] = TemplateResult(paths[index], *result)
+                done += 1
+
+            now = time.time()
+            expired = [i for i, (start, _) in running.items() if timeout and now - start > timeout]
+            if expired:
+                # A single worker can not be stopped, the pool is replaced and the other running files start again
+                pool.close()
+                for index in expired:
+                    LOG.warning('Template hooks timed out after %ss on %s' % (timeout, paths[index]))
+                    results[index] = TemplateResult(paths[index], None, None, None, 'Timed out after %ss' % timeout)
+                    done += 1
+                    del running[index]
+                waiting.extend(reversed(list(running)))
+                running.clear()
+                pool = _HookPool(template_name, processes)
+
+            if progress:
+                progress(done, len(paths))
+    finally:
+        pool.close()
+
+    return results
+
+
+class _HookPool(object):
+    """
+    Process pool running the template hooks that tells which files were lost with a worker that died. The pool
+    replaces a dead worker by itself but never answers the file it was running.
+    """
+
+    def __init__(self, template_name, processes):
+        """
+        :type template_name: str
+        :type processes: int
+        """
+        self._processes = processes
+        self._started = _SimpleQueue()  # Written before the hooks run, nothing is left in a buffer when one dies
+        self._workers = dict()  # dict[int,int] pid of the worker running each file
+        self._seen = set()  # set[int] pids of the workers found alive so far
+        self._pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(template_name, self._started))
+
+    def apply(self, index, path):
+        """
+        :type index: int
+        :type path: str
+        :rtype: multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(_resolve_in_worker, (index, path))
+
+    def lost(self, indexes):
+        """
+        :type indexes: list[int]
+        :param indexes: Files handed out and not answered yet
+        :rtype: list[int]
+        :return: Those whose worker died
+        """
+        while not self._started.empty():
+            index, pid = self._started.get()
+            self._workers[index] = pid
+
+        # Pool has no public list of its workers
+        alive = set(_.pid for _ in self._pool._pool if _.pid is not None and _.exitcode is None)
+        dead = self._seen - alive
+        self._seen.update(alive)
+        return [_ for _ in indexes if self._workers.get(_) in dead]
+
+    def failing_to_start(self):
+        """
+        :rtype: bool
+        :return: Workers keep dying before running any hook, on Windows when the main script can not be imported
+            again
+        """
+        return not self._workers and len(self._seen) >= 2 * self._processes
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+def _init_worker(template_name, started):
+    global _WORKER_TEMPLATE, _WORKER_STARTED
+    _WORKER_STARTED = started
+    try:
+        _WORKER_TEMPLATE = ParsingTemplate(template_name)
+    except Exception:
+        # Raising here would have the pool start new workers forever, every file reports the error instead
+        _WORKER_TEMPLATE = traceback.format_exc().strip().rsplit('\n', 1)[-1]
+
+
+def _resolve_in_worker(index, path):
+    """
+    :type index: int
+    :type path: str
+    :rtype: (str, list[str], str, str)
+    """
+    _WORKER_STARTED.put((index, os.getpid()))
+    if not isinstance(_WORKER_TEMPLATE, ParsingTemplate):
+        return None, None, None, 'Could not load template: %s' % _WORKER_TEMPLATE
+    return _run_hooks(_WORKER_TEMPLATE, path)
+
+
+def _run_hooks(template, path):
+    """
+    :type template: ParsingTemplate
+    :type path: str
+    :rtype: (str, list[str], str, str)
+    :return: Asset name, tags, thumbnail and error, exceptions are returned as the error so every file is answered
+    """
+    try:
+        return template.get_asset_name(path), template.get_tags(path), template.get_thumbnail(path), None
+    except Exception:
+        return None, None, None, traceback.format_exc().strip().rsplit('\n', 1)[-1]
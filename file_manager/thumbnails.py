@@ -0,0 +1,145 @@
+import os
+
+from .config import settings, LOG
+
+VARIANT_WIDTHS = (200, 400, 800)  # Pixel widths of the pre-scaled copies kept next to each thumbnail
+JPEG_QUALITY = 85
+
+
+def variant_path(path, width, alpha=False):
+    """
+    :type path: str
+    :param path: Path of the original thumbnail
+    :type width: int
+    :type alpha: bool
+    :param alpha: Images with transparency are stored as png, everything else as jpg
+    :rtype: str
+    """
+    return '%s_%d.%s' % (os.path.splitext(path)[0], width, 'png' if alpha else 'jpg')
+
+
+def generate_variants(path):
+    """
+    Write the scaled down copies of a thumbnail, replacing any previous ones.
+    Only widths smaller than the original are written.
+
+    :type path: str
+    :rtype: list[str]
+    :return: Paths of the written variants
+    """
+    # Imported here, the data layer uses the file helpers of this module and must load without a Qt binding
+    from Qt import QtCore, QtGui
+
+    remove_variants(path)
+
+    image = QtGui.QImageReader(path).read()
+    if image.isNull():
+        LOG.warning('Could not read thumbnail %s to build variants.' % path)
+        return list()
+
+    alpha = image.hasAlphaChannel()
+    written = list()
+    # Scale from the largest down, each step starting from the previous variant
+    for width in sorted(VARIANT_WIDTHS, reverse=True):
+        if width >= image.width():
+            continue
+        image = image.scaledToWidth(width, QtCore.Qt.SmoothTransformation)
+        out_path = variant_path(path, width, alpha)
+        if image.save(out_path, None, -1 if alpha else JPEG_QUALITY):
+            written.append(out_path)
+        else:
+            LOG.warning('Could not write thumbnail variant %s' % out_path)
+    return written
+
+
+def remove_variants(path):
+    """
+    :type path: str
+    """
+    for width in VARIANT_WIDTHS:
+        for alpha in (False, True):
+            _path = variant_path(path, width, alpha)
+            if os.path.isfile(_path):
+                try:
+                    os.remove(_path)
+                except OSError as e:
+                    LOG.warning('Could not remove thumbnail variant %s: %s' % (_path, e))
+
+
+def best_variant(path, size):
+    """
+    Smallest stored variant at least as wide as size, falling back to the original. Checks the disk so it is meant
+    to run off the GUI thread.
+
+    :type path: str
+    :type size: QtCore.QSize
+    :rtype: str
+    """
+    for width in sorted(VARIANT_WIDTHS):
+        if width < size.width():
+            continue
+        for alpha in (False, True):
+            _path = variant_path(path, width, alpha)
+            if os.path.isfile(_path):
+                return _path
+    return path
+
+
+def backfill_variants(overwrite=False, progress=None):
+    """
+    Build the variants of every asset thumbnail that does not have them yet, once per image however many assets
+    share it.
+
+    :type overwrite: bool
+    :param overwrite: Rebuild variants that already exist
+    :type progress: callable
+    :param progress: Called with the number of thumbnails checked so far
+    :rtype: dict[str,int]
+    :return: Number of thumbnails generated, skipped and missing
+    """
+    # Imported here, the data layer imports this module for assign_thumbnail
+    from .data.connection import get_engine
+    from .data.query import Query
+
+    query = Query('asset')
+    query.add_filter('thumbnail', operator=Query.OP.ISNOTNULL)
+
+    counts = dict(generated=0, skipped=0, missing=0)
+    checked = set()
+    for asset_record in get_engine().iter_select(query):
+        if asset_record.thumbnail in checked:
+            continue
+        checked.add(asset_record.thumbnail)
+        if progress:
+            progress(len(checked))
+
+        path = os.path.join(settings.thumbs_folder, asset_record.thumbnail)
+        if not os.path.isfile(path):
+            counts['missing'] += 1
+            continue
+
+        if not overwrite and _has_variants(path):
+            counts['skipped'] += 1
+            continue
+
+        generate_variants(path)
+        counts['generated'] += 1
+
+    LOG.info('Thumbnail variants: %(generated)d generated, %(skipped)d skipped, %(missing)d missing.' % counts)
+    return counts
+
+
+def _has_variants(path):
+    """
+    :type path: str
+    :rtype: bool
+    :return: Every variant generate_variants writes for the image exists, none for images up to the smallest width
+    """
+    from Qt import QtGui
+
+    # Only the header is read
+    width = QtGui.QImageReader(path).size().width()
+    if width < 0:
+        return False
+    return all(os.path.isfile(variant_path(path, _, False)) or os.path.isfile(variant_path(path, _, True))
+               for _ in VARIANT_WIDTHS if _ < width)
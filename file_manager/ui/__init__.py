@@ -46,14 +46,10 @@ class FileManagerApp(QtWidgets.QMainWindow):
         self.setWindowTitle('File Manager - %s' % VERSION)
 
     def _apply_asset_search(self, regex):
-        asset_records = list()
+        query = Query('asset')
         if regex:
-            query = Query('asset')
             query.add_filter('name', rvalue='.*%s.*' % regex, operator=Query.OP.MATCH)
-
-            engine = get_engine()
-            asset_records = engine.select(query)
-        self._viewer.view_assets(asset_records)
+        self._viewer.view_query(query)
 
     def _apply_tag_search(self, regex):
         asset_records = list()
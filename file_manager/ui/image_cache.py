@@ -0,0 +1,166 @@
+import time
+from collections import OrderedDict
+
+from ..config import settings
+
+NULL_COST = 64  # Bytes charged for an image that could not be read
+MIN_AGE = 1.0  # Seconds an image stays after being used, even over budget
+
+
+class ImageCache(object):
+    """
+    Process wide cache of decoded thumbnails keyed by (path, mtime, width, height), shared by every panel showing
+    images so a search running again, or another view of the same asset, paints without touching the disk.
+
+    The cache is bounded by the bytes the pixmaps take, evicting the least recently used. Images used in the last
+    MIN_AGE seconds are kept even over budget, a budget smaller than what is on screen would otherwise have the
+    visible cells evict each other and decode in a loop. Storing a newer mtime for a path drops every entry of the
+    older one. Pixmaps belong to the GUI thread, so does the cache.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # OrderedDict[(str, float, int, int), [QtGui.QPixmap, int, float]]
+        self._mtimes = dict()  # dict[str,float] mtime the cached entries of each path were read at
+        self._latest = dict()  # dict[str,(str, float, int, int)] most recently stored size of each path
+        self._counts = dict()  # dict[str,int] number of cached sizes of each path
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, path, size):
+        """
+        :type path: str
+        :type size: QtCore.QSize
+        :rtype: QtGui.QPixmap or None
+        :return: The image at exactly this size, null if it could not be read, None if it is not cached
+        """
+        key = (path, self._mtimes.get(path), size.width(), size.height())
+        item = self._entries.pop(key, None)
+        if item is None:
+            self._misses += 1
+            return None
+
+        # Re-insert to mark as most recently used
+        item[2] = time.time()
+        self._entries[key] = item
+        self._hits += 1
+        return item[0]
+
+    def latest(self, path):
+        """
+        Most recently stored image of a path at any size, used as a stand-in while the right size loads.
+
+        :type path: str
+        :rtype: QtGui.QPixmap or None
+        """
+        item = self._entries.get(self._latest.get(path))
+        return item[0] if item is not None else None
+
+    def mtime(self, path):
+        """
+        :type path: str
+        :rtype: float or None
+        :return: Modification time the cached images of path were read at
+        """
+        return self._mtimes.get(path)
+
+    def put(self, path, mtime, size, pixmap, cost=None):
+        """
+        :type path: str
+        :type mtime: float or None
+        :type size: QtCore.QSize
+        :param size: Size the image was requested at, the pixmap itself can be smaller to keep its aspect ratio
+        :type pixmap: QtGui.QPixmap
+        :type cost: int
+        :param cost: Bytes the value takes, only needed when storing something else than a single pixmap
+        """
+        if path in self._mtimes and self._mtimes[path] != mtime:
+            # The file changed, images read before are stale
+            self.discard(path)
+
+        key = (path, mtime, size.width(), size.height())
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        else:
+            self._counts[path] = self._counts.get(path, 0) + 1
+
+        if cost is None:
+            cost = pixmap_cost(pixmap)
+        self._entries[key] = [pixmap, cost, time.time()]
+        self._bytes += cost
+        self._mtimes[path] = mtime
+        self._latest[path] = key
+        self._trim()
+
+    def discard(self, path):
+        """
+        Drop every cached image of a path, used when the file was replaced.
+
+        :type path: str
+        """
+        for key in [k for k in self._entries if k[0] == path]:
+            self._bytes -= self._entries.pop(key)[1]
+        self._mtimes.pop(path, None)
+        self._latest.pop(path, None)
+        self._counts.pop(path, None)
+
+    def set_max_bytes(self, max_bytes):
+        """
+        :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self._trim()
+
+    def clear(self):
+        self._entries.clear()
+        self._mtimes.clear()
+        self._latest.clear()
+        self._counts.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """
+        :rtype: dict[str,int]
+        """
+        return dict(hits=self._hits, misses=self._misses, evictions=self._evictions, size=len(self._entries),
+                    bytes=self._bytes, max_bytes=self.max_bytes)
+
+    def _trim(self):
+        now = time.time()
+        while self._bytes > self.max_bytes and self._entries:
+            key, (_, cost, used) = next(iter(self._entries.items()))
+            if now - used < MIN_AGE:
+                break
+
+            del self._entries[key]
+            self._bytes -= cost
+            self._evictions += 1
+
+            path = key[0]
+            self._counts[path] -= 1
+            if not self._counts[path]:
+                del self._counts[path], self._mtimes[path]
+                self._latest.pop(path, None)
+            elif self._latest.get(path) == key:
+                del self._latest[path]
+
+
+def pixmap_cost(pixmap):
+    """
+    :type pixmap: QtGui.QPixmap
+    :rtype: int
+    """
+    if pixmap.isNull():
+        return NULL_COST
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+IMAGE_CACHE = ImageCache(max_bytes=settings.thumbnail_cache_mb * 1024 * 1024)
+FRAME_CACHE = ImageCache(max_bytes=settings.preview_cache_mb * 1024 * 1024)  # Hover previews of animated thumbnails
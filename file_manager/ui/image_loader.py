@@ -0,0 +1,212 @@
+import os
+import threading
+
+from Qt import QtCore, QtGui
+
+from ..config import LOG
+
+
+class ImageLoader(QtCore.QObject):
+    """
+    Decodes images on a thread pool, scaled down to the requested size while reading.
+
+    Requests are identified by (path, width, height). Results arrive through image_loaded on the thread the
+    loader lives in together with the modification time of the file, with a null QImage when the file could not be
+    read and None when the caller passed the mtime it already has and the file did not change since.
+    """
+    image_loaded = QtCore.Signal(object, object, object)  # (path, width, height), QtGui.QImage or None, float
+
+    def __init__(self, max_threads=None, resolver=None, *args, **kwargs):
+        """
+        :type max_threads: int
+        :param max_threads: Number of decoding threads, defaults to one less than the number of cores
+        :type resolver: callable
+        :param resolver: Called on the worker thread with (path, size), returns the file to actually read
+        """
+        super(ImageLoader, self).__init__(*args, **kwargs)
+
+        self._resolver = resolver
+
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads or max(1, QtCore.QThread.idealThreadCount() - 1))
+
+        self._pending = dict()  # dict[(str, int, int), _LoadTask]
+        self._lock = threading.Lock()
+
+        # Created after the pool so the pool, which waits for running tasks, is destroyed first
+        self._signals = _TaskSignals(self)
+        self._signals.finished.connect(self._task_finished)
+
+    def request(self, path, size, mtime=None):
+        """
+        Queue a decode unless the same image is already pending.
+
+        :type path: str
+        :type size: QtCore.QSize
+        :type mtime: float or None
+        :param mtime: Modification time of an already decoded copy, the file is only read if it changed
+        :rtype: (str, int, int)
+        :return: Key the result will be delivered with
+        """
+        key = (path, size.width(), size.height())
+        with self._lock:
+            if key in self._pending:
+                return key
+            task = self._create_task(key, mtime)
+            self._pending[key] = task
+        self._pool.start(task)
+        return key
+
+    def cancel(self, key):
+        """
+        Drop a pending request, a decode that already started still runs but its result is discarded.
+        """
+        with self._lock:
+            task = self._pending.pop(key, None)
+        if task is None:
+            return
+
+        task.cancelled = True
+        # QThreadPool.tryTake was added in Qt 5.9
+        if hasattr(self._pool, 'tryTake'):
+            self._pool.tryTake(task)
+
+    def pending(self):
+        """
+        :rtype: list[(str, int, int)]
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def _create_task(self, key, mtime):
+        return _LoadTask(key, self._signals, self._resolver, mtime)
+
+    def _task_finished(self, task, image, mtime):
+        with self._lock:
+            # A cancelled request may have been queued again, only the current task delivers
+            if self._pending.get(task.key) is not task:
+                return
+            del self._pending[task.key]
+        self.image_loaded.emit(task.key, image, mtime)
+
+
+class _TaskSignals(QtCore.QObject):
+    # QRunnable is not a QObject, results go through this object living on the loader's thread
+    finished = QtCore.Signal(object, object, object)  # _LoadTask, result of _LoadTask.read or None, float
+
+
+class _LoadTask(QtCore.QRunnable):
+    def __init__(self, key, signals, resolver=None, mtime=None):
+        super(_LoadTask, self).__init__()
+        # Lifetime is managed from Python through ImageLoader._pending
+        self.setAutoDelete(False)
+        self.key = key
+        self.cancelled = False
+        self._signals = signals
+        self._resolver = resolver
+        self._known_mtime = mtime
+
+    def run(self):
+        if self.cancelled:
+            return
+
+        path, width, height = self.key
+        target = QtCore.QSize(width, height)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        if mtime is not None and mtime == self._known_mtime:
+            if not self.cancelled:
+                self._signals.finished.emit(self, None, mtime)
+            return
+
+        try:
+            if self._resolver is not None:
+                path = self._resolver(path, target)
+            result = self.read(path, target)
+        except Exception as e:
+            LOG.debug('Could not load image %s: %s' % (path, e))
+            result = self.failed()
+
+        if not self.cancelled:
+            self._signals.finished.emit(self, result, mtime)
+
+    def read(self, path, target):
+        """
+        :type path: str
+        :type target: QtCore.QSize
+        :rtype: QtGui.QImage
+        """
+        reader = QtGui.QImageReader(path)
+        if hasattr(reader, 'setAutoTransform'):
+            reader.setAutoTransform(True)
+
+        source_size = reader.size()
+        if source_size.isValid():
+            scaled_size = source_size.scaled(target, QtCore.Qt.KeepAspectRatio)
+            if scaled_size.width() < source_size.width():
+                # Lets formats like jpeg decode straight at the smaller size
+                reader.setScaledSize(scaled_size)
+
+        image = reader.read()
+        if not image.isNull() and (image.width() > target.width() or image.height() > target.height()):
+            image = image.scaled(target, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        return image
+
+    def failed(self):
+        return QtGui.QImage()
+
+
+class FrameLoader(ImageLoader):
+    """
+    Decodes every frame of an animated image at once, scaled down to the requested size, so it can be played and
+    scrubbed without touching the file again.
+
+    image_loaded delivers a list of (QImage, delay in ms), empty when the file could not be read. Long animations
+    are thinned out to MAX_FRAMES, the delays of dropped frames are added to the kept ones so playback keeps its
+    length.
+    """
+    MAX_FRAMES = 120
+
+    def _create_task(self, key, mtime):
+        return _FramesTask(key, self._signals, self._resolver, mtime)
+
+
+class _FramesTask(_LoadTask):
+    def read(self, path, target):
+        """
+        :rtype: list[(QtGui.QImage, int)]
+        """
+        reader = QtGui.QImageReader(path)
+        count = reader.imageCount()
+        step = max(1, -(-count // FrameLoader.MAX_FRAMES))  # Rounded up
+
+        frames = list()
+        i = 0
+        while not self.cancelled:
+            # Frames are stored as differences to the previous ones, all have to be read even when dropped
+            image = reader.read()
+            if image.isNull():
+                break
+
+            delay = max(reader.nextImageDelay(), 20)
+            if i % step == 0:
+                if image.width() > target.width() or image.height() > target.height():
+                    image = image.scaled(target, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+                frames.append((image, delay))
+            elif frames:
+                frames[-1] = (frames[-1][0], frames[-1][1] + delay)
+            i += 1
+
+            if not reader.canRead():
+                break
+        return frames
+
+    def failed(self):
+        return list()
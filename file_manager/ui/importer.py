@@ -3,15 +3,18 @@ import os
 import threading
 
 from Qt import QtCore, QtWidgets
-from ..config import settings
+from ..config import settings, LOG
 from ..data.connection import get_engine
 from ..data.entities.asset import AssetEntity
 from ..data.entities.path import PathEntity
 from ..data.entities.tag import TagEntity
 from ..data.entities.tag_to_asset import TagToAssetEntity
+from ..data.entities.thumbnail import ThumbnailEntity
 from ..data.query import Query
-from ..template import ParsingTemplate
-from ..ui.widgets.dialogs import ask
+from ..scanner import scan
+from ..snapshot import Snapshot
+from ..template import resolve_paths
+from ..ui.widgets.dialogs import ask, show_error
 
 
 class FoundPathEvent(QtCore.QEvent):
@@ -22,14 +25,15 @@ class FoundPathEvent(QtCore.QEvent):
 
 
 class ResultEvent(QtCore.QEvent):
-    def __init__(self, paths):
+    def __init__(self, paths, snapshot=None):
         super(ResultEvent, self).__init__(self.Type(self.registerEventType()))
 
         self.paths = paths
+        self.snapshot = snapshot
 
 
 class SearchThread(threading.Thread):
-    def __init__(self, wdg, root_path, template, types_str):
+    def __init__(self, wdg, root_path, template, types_str, excludes_str='', parallel=True, incremental=True):
         super(SearchThread, self).__init__()
 
         self._wdg = wdg
@@ -37,6 +41,9 @@ class SearchThread(threading.Thread):
         self._template = template
 
         self._extensions = [x.strip() for x in types_str.split(',')] if types_str else list()
+        self._excludes = [x.strip() for x in excludes_str.split(',')] if excludes_str else list()
+        self._workers = settings.scan_workers if parallel else 1
+        self._incremental = incremental
 
         self._cancel = False
 
@@ -44,29 +51,24 @@ class SearchThread(threading.Thread):
         self._cancel = True
 
     def run(self):
-        if self._extensions:
-            self._extensions = ['.' + x.lstrip('.').lower() for x in self._extensions[:]]
-
         module = imp.load_source('template', self._template) if self._template else None
 
-        found = list()
-        for root, d, files in os.walk(self._root_path):
-            if self._cancel:
-                break
-            QtWidgets.QApplication.postEvent(self._wdg, FoundPathEvent(len(found)))
-            for name in files:
-                ext = os.path.splitext(name)[1]
-                if self._extensions and ext.lower() not in self._extensions:
-                    continue
-
-                found_path = os.path.join(root, name).replace('\\', '/')
-                if module and hasattr(module, 'is_valid'):
-                    if not module.is_valid(found_path):
-                        continue
-
-                found.append(found_path)
-        else:
-            QtWidgets.QApplication.postEvent(self._wdg, ResultEvent(found))
+        # A full scan still rebuilds the snapshot for the next incremental one
+        snapshot = Snapshot(self._root_path, self._extensions, self._excludes, self._template,
+                            reset=not self._incremental)
+        found = scan(self._root_path, self._extensions, self._excludes, workers=self._workers,
+                     progress=self._progress, cancelled=lambda: self._cancel, snapshot=snapshot)
+        if self._cancel:
+            snapshot.close()
+            return
+
+        if module and hasattr(module, 'is_valid'):
+            found = [found_path for found_path in found if module.is_valid(found_path)]
+
+        QtWidgets.QApplication.postEvent(self._wdg, ResultEvent(found, snapshot))
+
+    def _progress(self, folder_count, file_count):
+        QtWidgets.QApplication.postEvent(self._wdg, FoundPathEvent(file_count))
 
 
 class AssetImporter(QtWidgets.QDialog):
@@ -81,6 +83,9 @@ class AssetImporter(QtWidgets.QDialog):
         self._edit_path = QtWidgets.QLineEdit()
         self._btn_browse = QtWidgets.QPushButton('...')
         self._edit_types = QtWidgets.QLineEdit()
+        self._edit_excludes = QtWidgets.QLineEdit()
+        self._chk_parallel = QtWidgets.QCheckBox('Scan several folders at once')
+        self._chk_incremental = QtWidgets.QCheckBox('Only scan folders changed since the last import')
         self._cmbo_templates = QtWidgets.QComboBox()
 
         self._btn_import = QtWidgets.QPushButton('Import Assets')
@@ -92,9 +97,39 @@ class AssetImporter(QtWidgets.QDialog):
 
     def event(self, event):
         if isinstance(event, ResultEvent):
-            if import_directory_tree(self._edit_path.text().replace('\\', '/'),
-                                     self._current_template(),
-                                     event.paths):
+            dlg = QtWidgets.QProgressDialog('Running template...', 'Cancel', 0, 0, self)
+            dlg.setWindowTitle('Import Assets')
+            dlg.setWindowModality(QtCore.Qt.WindowModal)
+
+            def _progress(text, done, total):
+                dlg.setMaximum(total)
+                dlg.setValue(done)
+                dlg.setLabelText(text)
+                QtWidgets.QApplication.processEvents()
+
+            imported = False
+            error = None
+            try:
+                imported = import_directory_tree(self._edit_path.text().replace('\\', '/'),
+                                                 self._current_template(),
+                                                 event.paths,
+                                                 event.snapshot,
+                                                 progress=_progress,
+                                                 cancelled=dlg.wasCanceled)
+            except Exception as e:
+                # An exception leaving a Qt event handler is swallowed, the dialog would just stay disabled
+                LOG.exception('Import failed')
+                error = e
+            finally:
+                dlg.close()
+                if event.snapshot is not None:
+                    event.snapshot.close()
+
+            if error is not None:
+                show_error('Import Assets', 'Import failed: %s\n\nBatches imported before the error are kept, '
+                                            'importing again adds the remaining files.' % error)
+
+            if imported:
                 self.accept()
             else:
                 self._btn_import.setEnabled(True)
@@ -113,8 +148,12 @@ class AssetImporter(QtWidgets.QDialog):
         lyt_editors.addWidget(self._btn_browse, 0, 2)
         lyt_editors.addWidget(QtWidgets.QLabel('File Types'), 1, 0)
         lyt_editors.addWidget(self._edit_types, 1, 1)
-        lyt_editors.addWidget(QtWidgets.QLabel('Template'), 2, 0)
-        lyt_editors.addWidget(self._cmbo_templates, 2, 1)
+        lyt_editors.addWidget(QtWidgets.QLabel('Exclude'), 2, 0)
+        lyt_editors.addWidget(self._edit_excludes, 2, 1)
+        lyt_editors.addWidget(QtWidgets.QLabel('Template'), 3, 0)
+        lyt_editors.addWidget(self._cmbo_templates, 3, 1)
+        lyt_editors.addWidget(self._chk_parallel, 4, 1)
+        lyt_editors.addWidget(self._chk_incremental, 5, 1)
 
         lyt_buttons = QtWidgets.QHBoxLayout()
         lyt_buttons.addWidget(self._btn_import)
@@ -136,6 +175,9 @@ class AssetImporter(QtWidgets.QDialog):
         self.setWindowTitle('Import Assets')
         self._edit_path.setPlaceholderText('Top Level Folder Path')
         self._edit_types.setPlaceholderText('List of types in form of "fbx,mov,jpg"')
+        self._edit_excludes.setPlaceholderText('Names or paths to skip in form of ".git,*_bak.*,renders/cache"')
+        self._chk_parallel.setChecked(settings.scan_workers > 1)
+        self._chk_incremental.setChecked(True)
         self.setMinimumWidth(600)
 
         if AssetImporter.CACHED_PATH:
@@ -172,7 +214,9 @@ class AssetImporter(QtWidgets.QDialog):
             self._thread.stop()
             self._thread.join()
 
-        self._thread = SearchThread(self, path, template, self._edit_types.text().strip())
+        self._thread = SearchThread(self, path, template, self._edit_types.text().strip(),
+                                    self._edit_excludes.text().strip(), self._chk_parallel.isChecked(),
+                                    self._chk_incremental.isChecked())
         self._thread.start()
 
         self._btn_import.setEnabled(False)
@@ -184,13 +228,32 @@ class AssetImporter(QtWidgets.QDialog):
         return template
 
 
-def import_directory_tree(root_path, template, paths):
+def import_directory_tree(root_path, template, paths, snapshot=None, progress=None, cancelled=None):
+    """
+    Import the paths not in the database yet, in stages: the template resolves the name, tags and thumbnail of
+    every path in a pool of processes, thumbnails are copied into the store, then assets, paths, missing tags and
+    links are created with a few bulk statements per batch of import_batch_size paths, each batch in one
+    transaction. Paths the template fails on are logged and left out.
+
+    :type root_path: str
+    :type template: str
+    :type paths: list[str]
+    :type snapshot: file_manager.snapshot.Snapshot
+    :param snapshot: Scan the paths came from, committed once every one of them is in the database
+    :type progress: callable
+    :param progress: Called with a description of the stage, the steps done and the total, while the template runs,
+        for each thumbnail copied and each batch imported
+    :type cancelled: callable
+    :param cancelled: Polled until the thumbnails are copied, nothing is imported when it returns True
+    :rtype: bool
+    """
     engine = get_engine()
 
-    if paths:
-        existing_paths = engine.select(Query('path', filepath=paths))
-        _paths = [x.filepath for x in existing_paths]
-        paths = list(set(paths) - set(_paths))
+    paths = _new_paths(engine, paths)
+
+    if not paths and snapshot is not None:
+        # Everything found is imported already
+        snapshot.commit()
 
     types_found = set()
     for item in paths:
@@ -203,53 +266,93 @@ def import_directory_tree(root_path, template, paths):
     if not paths:
         return False
 
-    _tmplt = ParsingTemplate(template)
-
-    # Create assets
-    for path in paths:
-        asset_name = _tmplt.get_asset_name(path)
-        tags = _tmplt.get_tags(path)
-        thumbnail = _tmplt.get_thumbnail(path)
-
-        path_rec = None
-        created_tags = list()
-
-        # Create Asset
-        asset_rec = engine.create(AssetEntity(name=asset_name))
-        """:type: file_manager.data.entities.asset.AssetEntity"""
-
-        try:
-            # Asset Paths
-            _sub_folders = path.replace(root_path, '').lstrip('/').rsplit('/', 1)[0]
-            path_rec = engine.create(PathEntity(asset_rec.id, path, _sub_folders))
-
-            # Create New Tags
-            _q = Query('tag', name='new')
-            _q.add_filter('name', tags, operator=_q.OP.ISIN)
-            tag_recs = engine.select(_q)
-            _new_tags = set(tags) - {t.name for t in tag_recs}
-            for new_tag in _new_tags:
-                _new_tag_rec = engine.create(TagEntity(new_tag))
-                created_tags.append(_new_tag_rec)
-            tag_recs += created_tags
-
-            # Assign Tags
-            tags_to_assets = list()
-            for tag_rec in tag_recs:
-                tags_to_assets.append(TagToAssetEntity(asset_rec.id, tag_rec.id))
-            engine.create_many(tags_to_assets)
-
-            # Assign Thumbnail
-            if thumbnail:
-                asset_rec.assign_thumbnail(thumbnail)
-
-        except:
-            # Revert Creation
-            if path_rec:
-                engine.delete(path_rec)
-            if created_tags:
-                engine.delete_many(created_tags)
-            engine.delete(asset_rec)
-            raise
+    # Everything the template decides, before the database is touched
+    def _template_progress(done, total):
+        progress('Running template on %d of %d files...' % (done, total), done, total)
+
+    results = resolve_paths(template, paths, progress=_template_progress if progress else None, cancelled=cancelled)
+    if cancelled and cancelled():
+        return False
 
+    items = list()
+    failed = 0
+    for result in results:
+        if result.error:
+            LOG.warning('Skipped %s, template failed: %s' % (result.path, result.error))
+            failed += 1
+        else:
+            items.append(result._replace(tags=sorted(set(result.tags or list()))))
+
+    # Copied outside of the transactions, files of a batch that is rolled back are collected as orphans later
+    thumbnails = sorted(set(x.thumbnail for x in items if x.thumbnail))
+    images = dict()
+    for i, thumbnail in enumerate(thumbnails):
+        if cancelled and cancelled():
+            return False
+        images[thumbnail] = ThumbnailEntity.write(thumbnail)
+        if progress:
+            progress('Copying thumbnail %d of %d...' % (i + 1, len(thumbnails)), i + 1, len(thumbnails))
+
+    batch_size = settings.import_batch_size
+    for i in range(0, len(items), batch_size):
+        if progress:
+            progress('Importing %d of %d files...' % (i, len(items)), i, len(items))
+        with engine.transaction():
+            _import_batch(engine, root_path, items[i:i + batch_size], images)
+
+    if failed:
+        # Not committed so the next incremental import runs the template on the skipped files again
+        LOG.warning('%d of %d files were skipped.' % (failed, len(results)))
+    elif snapshot is not None:
+        snapshot.commit()
     return True
+
+
+def _new_paths(engine, paths):
+    """
+    :type engine: file_manager.data.engines.base_engine.BaseEngine
+    :type paths: list[str]
+    :rtype: list[str]
+    :return: Sorted paths that are not in the database yet
+    """
+    paths = sorted(set(paths))
+    existing = set()
+    batch_size = settings.db_bulk_batch_size
+    for i in range(0, len(paths), batch_size):
+        existing.update(x.filepath for x in engine.select(Query('path', filepath=paths[i:i + batch_size])))
+    return [x for x in paths if x not in existing]
+
+
+def _import_batch(engine, root_path, items, images):
+    """
+    :type engine: file_manager.data.engines.base_engine.BaseEngine
+    :type root_path: str
+    :type items: list[file_manager.template.TemplateResult]
+    :type images: dict[str,(str, str)]
+    :param images: sha1 and extension of the written thumbnails by source path
+    """
+    thumbnails = iter(ThumbnailEntity.add_references([images[x.thumbnail] for x in items if x.thumbnail]))
+
+    assets = list()
+    for item in items:
+        thumbnail = next(thumbnails).filename if item.thumbnail else None
+        assets.append(AssetEntity(name=item.asset_name, thumbnail=thumbnail))
+    engine.create_many(assets)
+
+    path_recs = list()
+    for item, asset in zip(items, assets):
+        _sub_folders = item.path.replace(root_path, '').lstrip('/').rsplit('/', 1)[0]
+        path_recs.append(PathEntity(asset.id, item.path, _sub_folders))
+    engine.create_many(path_recs)
+
+    tag_names = sorted(set(tag for item in items for tag in item.tags))
+    tags = dict((x.name, x) for x in engine.select(Query('tag', name=tag_names))) if tag_names else dict()
+    new_tags = [TagEntity(name) for name in tag_names if name not in tags]
+    engine.create_many(new_tags)
+    tags.update((x.name, x) for x in new_tags)
+
+    links = list()
+    for item, asset in zip(items, assets):
+        for tag in item.tags:
+            links.append(TagToAssetEntity(asset.id, tags[tag].id))
+    engine.create_many(links)
@@ -1,10 +1,15 @@
-from Qt.QtCore import Signal
-from Qt.QtWidgets import QMenuBar
+from Qt.QtCore import Qt, Signal
+from Qt.QtWidgets import QApplication, QMenuBar, QMessageBox, QProgressDialog
 
+from ..config import settings
 from ..data.connection import get_engine
 from ..data.entities import TagEntity, AssetEntity
 from ..data.entities.application import ApplicationEntity
+from ..data.entities.thumbnail import ThumbnailEntity
+from ..data.identity_map import IDENTITY_MAP
 from ..data.query import Query
+from ..thumbnails import backfill_variants
+from ..ui.image_cache import IMAGE_CACHE, FRAME_CACHE
 from ..ui.importer import AssetImporter
 from ..ui.table_editor import TableEditor
 from ..ui.widgets.dialogs import ask
@@ -24,6 +29,9 @@ class FileManagerMenu(QMenuBar):
         self.edit_menu.addAction('Tag Manager...', self._manage_tags)
 
         self.super_menu = self.addMenu('Super User')
+        self.super_menu.addAction('Build Thumbnail Variants', self._build_thumbnail_variants)
+        self.super_menu.addAction('Collect Unused Thumbnails', self._collect_thumbnails)
+        self.super_menu.addAction('Cache Statistics...', self._show_cache_stats)
         self.super_menu.addAction('Clear Database', self._clear_database)
 
     def _manage_tags(self):
@@ -44,10 +52,72 @@ class FileManagerMenu(QMenuBar):
 
         engine = get_engine()
 
-        AssetEntity.delete(engine.select(Query('asset')))
-        engine.delete_many(engine.select(Query('tag')))
+        # Delete a batch at a time, re-querying each round so no cursor is left open while writing
+        batch_size = settings.db_stream_batch_size
+        while True:
+            assets = engine.select(Query('asset').set_limit(batch_size))
+            if not assets:
+                break
+            AssetEntity.delete(assets)
+        while True:
+            tags = engine.select(Query('tag').set_limit(batch_size))
+            if not tags:
+                break
+            engine.delete_many(tags)
 
         self.database_cleared.emit()
 
+    def _build_thumbnail_variants(self):
+        dlg = QProgressDialog('Building thumbnail variants...', None, 0, 0, self)
+        dlg.setWindowTitle('Thumbnail Variants')
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.show()
+
+        def _progress(count):
+            if count % 25 == 0:
+                dlg.setLabelText('Checked %d thumbnails...' % count)
+                QApplication.processEvents()
+
+        try:
+            counts = backfill_variants(progress=_progress)
+        finally:
+            dlg.close()
+
+        QMessageBox.information(self, 'Thumbnail Variants',
+                                '%(generated)d generated, %(skipped)d already built, %(missing)d missing.' % counts)
+
+    def _collect_thumbnails(self):
+        dlg = QProgressDialog('Counting thumbnail references...', None, 0, 0, self)
+        dlg.setWindowTitle('Thumbnail Store')
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.show()
+        QApplication.processEvents()
+
+        try:
+            counts = ThumbnailEntity.collect_garbage()
+        finally:
+            dlg.close()
+
+        QMessageBox.information(self, 'Thumbnail Store', '%(kept)d images in use, %(removed)d removed, '
+                                                         '%(orphans)d orphan files removed.' % counts)
+
+    def _show_cache_stats(self):
+        images = IMAGE_CACHE.stats()
+        images['mb'] = images['bytes'] / 1048576.0
+        images['max_mb'] = images['max_bytes'] / 1048576.0
+        lookups = images['hits'] + images['misses']
+        images['ratio'] = 100.0 * images['hits'] / lookups if lookups else 0.0
+
+        previews = FRAME_CACHE.stats()
+        previews['mb'] = previews['bytes'] / 1048576.0
+
+        records = IDENTITY_MAP.stats()
+
+        text = 'Thumbnails: %(size)d images, %(mb).1f of %(max_mb).0f MB\n' \
+               'Hits %(hits)d, misses %(misses)d (%(ratio).0f%% hit), evictions %(evictions)d' % images
+        text += '\n\nHover previews: %(size)d, %(mb).1f MB, evictions %(evictions)d' % previews
+        text += '\n\nRecords: %(size)d cached\nHits %(hits)d, misses %(misses)d' % records
+        QMessageBox.information(self, 'Cache Statistics', text)
+
     def _import_assets(self):
         AssetImporter(self).exec_()
@@ -89,8 +89,7 @@ class TableEditor(QDialog):
         query = Query(self._entity.NAME)
 
         engine = get_engine()
-        result = engine.select(query)
-        for item in result:
+        for item in engine.iter_select(query):
             self._add_row(item)
 
         for i in range(self._tree.columnCount()):
@@ -1,21 +1,21 @@
-from operator import attrgetter
-
-from Qt.QtCore import Qt
-from Qt.QtWidgets import QWidget, QGridLayout, QScrollArea, QVBoxLayout
+from Qt.QtWidgets import QWidget, QVBoxLayout, QInputDialog
 
+from .model import AssetModel
 from .toolbar import ViewerToolbar
-from ..thumbnail import FileManagerThumbnail
-from ...config import settings
+from .view import AssetListView
+from .. import thumbnail
+from ..widgets.dialogs import ask
+from ..widgets.tag_editor import TagEditor
 from ...data.connection import get_engine
-from ...data.query import Query
-from ...utils import fm_groupby
+from ...data.entities import AssetEntity
 
 
 class FileManagerViewer(QWidget):
     def __init__(self, *args, **kwargs):
         super(FileManagerViewer, self).__init__(*args, **kwargs)
 
-        self._lyt_grid = QGridLayout()
+        self._model = AssetModel(self)
+        self._view = AssetListView()
         self._toolbar = ViewerToolbar()
 
         self._build_ui()
@@ -23,98 +23,82 @@ class FileManagerViewer(QWidget):
         self._setup_ui()
 
     def view_assets(self, asset_records):
-        self._clear_grid()
-
-        if not asset_records:
-            return
-
-        asset_records.sort(key=attrgetter('name'))
-
-        engine = get_engine()
-
-        # Find tags
-        _links = engine.select(Query('tag_to_asset', asset_id=[_.id for _ in asset_records]))
-        links_by_asset = dict(fm_groupby(_links, attrgetter('asset_id')))
-        _tags = engine.select(Query('tag', id=[_.tag_id for _ in _links])) if _links else list()
-        tags_by_id = {_.id: _ for _ in _tags}
-
-        # Find paths
-        _paths = engine.select(Query('path', asset_id=[_.id for _ in asset_records]))
-        paths_by_asset = dict(fm_groupby(_paths, attrgetter('asset_id')))
+        """
+        Show already loaded assets.
 
-        FileManagerThumbnail.cache_app_icons()
+        :type asset_records: list[file_manager.data.entities.asset.AssetEntity]
+        """
+        thumbnail.cache_app_icons()
+        self._model.set_assets(asset_records)
 
-        widgets = list()
-        for asset_record in asset_records:
-            _links = links_by_asset.get(asset_record.id, list())
-            tags = [tags_by_id.get(link.tag_id) for link in _links]
+    def view_query(self, query):
+        """
+        Show the assets matching the query, further pages are fetched from the database as the user scrolls.
 
-            paths = paths_by_asset.get(asset_record.id, list())
-
-            thumb = FileManagerThumbnail(asset_record, tags, paths)
-            thumb.deleted.connect(self._remove_thumb)
-
-            widgets.append(thumb)
-
-        self._layout_widgets(widgets)
+        :type query: file_manager.data.query.Query
+        """
+        thumbnail.cache_app_icons()
+        self._model.set_query(query)
 
     def _build_ui(self):
-        self._lyt_grid.setContentsMargins(0, 0, 0, 0)
-        self._lyt_grid.setSpacing(10)
-        self._lyt_grid.setAlignment(Qt.AlignTop | Qt.AlignLeft)
-
-        scroll_area = QScrollArea()
-        scroll_area.setFrameStyle(0)
-        scroll_area.setWidget(QWidget())
-        scroll_area.widget().setLayout(self._lyt_grid)
-        scroll_area.setWidgetResizable(True)
+        self._view.setModel(self._model)
 
         lyt_main = QVBoxLayout()
         lyt_main.setContentsMargins(0, 0, 0, 0)
         lyt_main.setSpacing(0)
-        lyt_main.addWidget(scroll_area)
+        lyt_main.addWidget(self._view)
         lyt_main.addWidget(self._toolbar)
         self.setLayout(lyt_main)
 
     def _build_connections(self):
         self._toolbar.thumb_size_changed.connect(self.update_layout)
 
-    def _setup_ui(self):
-        pass
+        self._view.title_double_clicked.connect(self._edit_title)
+        self._view.tags_clicked.connect(self._manage_tags)
+        self._view.trash_clicked.connect(self._delete_asset)
+        self._view.app_clicked.connect(self._open_application)
+        self._view.app_menu_requested.connect(self._show_path_menu)
+        self._view.thumbnail_menu_requested.connect(self._show_thumbnail_menu)
 
-    def _remove_thumb(self):
-        thumb = self.sender()
-        self._lyt_grid.removeWidget(thumb)
-        thumb.deleteLater()
+    def _setup_ui(self):
         self.update_layout()
 
     def update_layout(self):
-        widgets = list()
-        while self._lyt_grid.count():
-            wdg = self._lyt_grid.itemAt(0).widget()
-            widgets.append(wdg)
-            self._lyt_grid.removeWidget(wdg)
-
-        self._layout_widgets(widgets)
-
-    def _layout_widgets(self, widgets):
-        for wdg in widgets:
-            wdg.update_thumb_size()
-        w = self.width()
-        items_per_row = int(w / ((settings.thumb_size + 16) * FileManagerThumbnail.REF_WIDTH / 100.0))
-        r, c = 0, 0
-        while widgets:
-            n = widgets.pop(0)
-            self._lyt_grid.addWidget(n, r, c)
-            c += 1
-            if c >= items_per_row:
-                r += 1
-                c = 0
-
-    def _clear_grid(self):
-        while self._lyt_grid.count():
-            item = self._lyt_grid.itemAt(0)
-            wdg = item.widget()
-            self._lyt_grid.removeWidget(wdg)
-            wdg.close()
-            wdg.deleteLater()
+        self._view.update_cell_size()
+
+    def _edit_title(self, index):
+        asset_record = index.data(AssetModel.AssetRole)
+        new_text, ok = QInputDialog.getText(self, 'New Title', 'Title:', text=asset_record.name)
+        if not ok:
+            return
+
+        asset_record.name = new_text
+        get_engine().update(asset_record)
+        self._model.refresh_row(index.row())
+
+    def _manage_tags(self, index):
+        asset_record = index.data(AssetModel.AssetRole)
+        TagEditor([asset_record], parent=self).exec_()
+        self._model.refresh_row(index.row(), tags=True)
+
+    def _delete_asset(self, index):
+        if not ask('Delete Asset?', 'Are you sure you want to remove this asset?'):
+            return
+
+        AssetEntity.delete([index.data(AssetModel.AssetRole)])
+        self._model.remove_row(index.row())
+
+    def _open_application(self, index, path_index):
+        thumbnail.open_application(index.data(AssetModel.PathsRole)[path_index])
+
+    def _show_path_menu(self, index, path_index):
+        thumbnail.show_path_menu(index.data(AssetModel.PathsRole)[path_index])
+
+    def _show_thumbnail_menu(self, index):
+        asset_record = index.data(AssetModel.AssetRole)
+        if not thumbnail.show_thumbnail_menu(asset_record, index.data(AssetModel.PathsRole), parent=self):
+            return
+
+        # The new image may have been written over the old file
+        self._view.delegate().forget(self._view.delegate().thumbnail_path(asset_record))
+        self._model.refresh_row(index.row())
@@ -0,0 +1,295 @@
+import os
+
+from Qt import QtCore, QtGui, QtWidgets
+
+from .model import AssetModel
+from .. import thumbnail
+from ..image_cache import IMAGE_CACHE, FRAME_CACHE
+from ..image_loader import ImageLoader
+from ...config import settings
+from ...thumbnails import best_variant
+
+MARGIN = 5
+SPACING = 4
+TITLE_HEIGHT = 35
+BUTTON_SIZE = 26
+APP_WIDTH = 32
+CHIP_HEIGHT = 20
+CHIP_SPACING = 2
+CHIP_ROWS = 2
+
+
+class AssetDelegate(QtWidgets.QStyledItemDelegate):
+    """
+    Paints an asset cell: title, thumbnail, application icons, tag and trash buttons and the tag chips.
+
+    Every cell has the same size so the view can lay out any number of rows without asking each item.
+    Thumbnails are decoded in the background into the shared IMAGE_CACHE, a placeholder is painted until image_ready
+    is emitted. Cached images are painted right away and checked against the file once after every reset.
+    """
+    image_ready = QtCore.Signal()
+
+    def __init__(self, *args, **kwargs):
+        super(AssetDelegate, self).__init__(*args, **kwargs)
+
+        self._checked = set()  # set[str] images compared against their file since the last revalidate
+        self._requests = dict()  # dict[(str, int, int),QtCore.QPersistentModelIndex] pending decodes
+
+        # Reads the smallest pre-scaled variant covering the cell instead of the full size original
+        self._loader = ImageLoader(resolver=best_variant, parent=self)
+        self._loader.image_loaded.connect(self._image_loaded)
+        self._preview = None  # (QtCore.QPersistentModelIndex, QtGui.QPixmap, float) frame played in place of a thumbnail
+
+        self._title_font = QtGui.QFont('Calibri', 14, QtGui.QFont.Bold)
+        self._chip_font = QtGui.QFont()
+        self._chip_font.setPointSize(12)
+        self._tag_pixmap = QtGui.QIcon('images:tag.png').pixmap(BUTTON_SIZE - 6)
+        self._trash_pixmap = QtGui.QIcon('images:trash.png').pixmap(BUTTON_SIZE - 6)
+
+    @staticmethod
+    def cell_size():
+        """
+        :rtype: QtCore.QSize
+        """
+        width = int(thumbnail.thumb_width())
+        height = MARGIN + TITLE_HEIGHT + SPACING + int(width * 3 / 4.0) + SPACING + BUTTON_SIZE + SPACING
+        height += CHIP_ROWS * CHIP_HEIGHT + (CHIP_ROWS - 1) * CHIP_SPACING + MARGIN
+        return QtCore.QSize(width + 12, height)
+
+    @staticmethod
+    def regions(rect, path_count):
+        """
+        Layout of the parts of a cell.
+
+        :type rect: QtCore.QRect
+        :param rect: Rectangle of the whole cell
+        :type path_count: int
+        :rtype: dict[str,QtCore.QRect or list[QtCore.QRect]]
+        """
+        left = rect.left() + MARGIN
+        width = rect.width() - 2 * MARGIN
+        top = rect.top() + MARGIN
+
+        title = QtCore.QRect(left, top, width, TITLE_HEIGHT)
+        top += TITLE_HEIGHT + SPACING
+
+        image_width = int(thumbnail.thumb_width())
+        image_height = int(image_width * 3 / 4.0)
+        image = QtCore.QRect(left + (width - image_width) // 2, top, image_width, image_height)
+        top += image_height + SPACING
+
+        trash = QtCore.QRect(left + width - BUTTON_SIZE, top, BUTTON_SIZE, BUTTON_SIZE)
+        tags = trash.translated(-(BUTTON_SIZE + SPACING), 0)
+        app_count = min(path_count, max(0, (tags.left() - left) // APP_WIDTH))
+        apps = [QtCore.QRect(left + i * APP_WIDTH, top, APP_WIDTH, BUTTON_SIZE) for i in range(app_count)]
+        top += BUTTON_SIZE + SPACING
+
+        chips = QtCore.QRect(left, top, width, rect.bottom() - MARGIN - top + 1)
+
+        return dict(title=title, image=image, apps=apps, tags=tags, trash=trash, chips=chips)
+
+    @staticmethod
+    def hit_test(rect, pos, path_count):
+        """
+        :type rect: QtCore.QRect
+        :type pos: QtCore.QPoint
+        :type path_count: int
+        :rtype: (str or None, int or None)
+        :return: Name of the region under pos and, for application icons, the index of the path
+        """
+        regions = AssetDelegate.regions(rect, path_count)
+        for i, app_rect in enumerate(regions['apps']):
+            if app_rect.contains(pos):
+                return 'app', i
+        for name in ('title', 'image', 'tags', 'trash'):
+            if regions[name].contains(pos):
+                return name, None
+        return None, None
+
+    @staticmethod
+    def thumbnail_path(asset_record):
+        """
+        :type asset_record: file_manager.data.entities.asset.AssetEntity
+        :rtype: str or None
+        """
+        if not asset_record.thumbnail:
+            return None
+        return os.path.join(settings.thumbs_folder, asset_record.thumbnail)
+
+    def set_preview(self, index, frame, progress=0.0):
+        """
+        Paint frame in place of the thumbnail of index with a progress bar along its bottom, pass None to stop.
+
+        :type index: QtCore.QModelIndex or None
+        :type frame: QtGui.QPixmap or None
+        :type progress: float
+        :param progress: Position in the animation, from 0 to 1
+        """
+        if index is None or frame is None:
+            self._preview = None
+        else:
+            self._preview = (QtCore.QPersistentModelIndex(index), frame, progress)
+
+    def forget(self, path):
+        """
+        Drop the cached pixmaps of an image so it is read again, used when the file was replaced.
+        """
+        IMAGE_CACHE.discard(path)
+        FRAME_CACHE.discard(path)
+        for key in [k for k in self._requests if k[0] == path]:
+            self._loader.cancel(key)
+            del self._requests[key]
+        self._checked.discard(path)
+
+    def revalidate(self):
+        """
+        Check the cached images painted from now on against their files, in case they changed on disk.
+        """
+        self._checked.clear()
+
+    def cancel_hidden(self, view):
+        """
+        Cancel pending decodes of items that are no longer visible in the view or were requested at another size.
+
+        :type view: QtWidgets.QAbstractItemView
+        """
+        viewport_rect = view.viewport().rect()
+        image_size = AssetDelegate.regions(QtCore.QRect(0, 0, 1, 1), 0)['image'].size()
+        for key, persistent_index in list(self._requests.items()):
+            index = QtCore.QModelIndex(persistent_index)
+            if key[1:] == (image_size.width(), image_size.height()) and index.isValid() and \
+                    view.visualRect(index).intersects(viewport_rect):
+                continue
+            self._loader.cancel(key)
+            del self._requests[key]
+
+    def sizeHint(self, option, index):
+        return AssetDelegate.cell_size()
+
+    def paint(self, painter, option, index):
+        asset_record = index.data(AssetModel.AssetRole)
+        if asset_record is None:
+            return
+
+        tag_records = index.data(AssetModel.TagsRole) or list()
+        path_records = index.data(AssetModel.PathsRole) or list()
+        palette = option.palette
+        regions = AssetDelegate.regions(option.rect, len(path_records))
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+
+        # Frame
+        hovered = bool(option.state & QtWidgets.QStyle.State_MouseOver)
+        painter.setPen(palette.color(QtGui.QPalette.Highlight if hovered else QtGui.QPalette.Mid))
+        painter.setBrush(QtCore.Qt.NoBrush)
+        painter.drawRect(option.rect.adjusted(0, 0, -1, -1))
+
+        # Title
+        painter.setFont(self._title_font)
+        painter.setPen(palette.color(QtGui.QPalette.Text))
+        painter.drawText(regions['title'], QtCore.Qt.AlignCenter | QtCore.Qt.TextWordWrap,
+                         (asset_record.name or '').replace('_', ' '))
+
+        self._paint_image(painter, regions['image'], index, asset_record, palette)
+
+        # Application icons
+        painter.setFont(option.font)
+        for app_rect, path_record in zip(regions['apps'], path_records):
+            app_pix = thumbnail.APP_CACHE.get(path_record.type)
+            if app_pix:
+                _draw_centered(painter, app_rect, app_pix)
+            else:
+                painter.drawText(app_rect, QtCore.Qt.AlignCenter, path_record.type or '')
+
+        _draw_centered(painter, regions['tags'], self._tag_pixmap)
+        _draw_centered(painter, regions['trash'], self._trash_pixmap)
+
+        self._paint_chips(painter, regions['chips'], tag_records, palette)
+
+        painter.restore()
+
+    def _paint_image(self, painter, rect, index, asset_record, palette):
+        if self._preview is not None and self._preview[0] == QtCore.QPersistentModelIndex(index):
+            _, frame, progress = self._preview
+            if frame.width() > rect.width() or frame.height() > rect.height():
+                # Frames are decoded at the cell size, only a zoom during playback makes them too big
+                frame = frame.scaled(rect.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.FastTransformation)
+            _draw_centered(painter, rect, frame)
+
+            bar = QtCore.QRectF(rect)
+            bar.setTop(bar.bottom() - 2)
+            bar.setWidth(bar.width() * progress)
+            painter.fillRect(bar, QtGui.QColor(255, 255, 255))
+            return
+
+        path = AssetDelegate.thumbnail_path(asset_record)
+        if not path:
+            painter.drawText(rect, QtCore.Qt.AlignCenter, '---')
+            return
+
+        pixmap = IMAGE_CACHE.get(path, rect.size())
+        if pixmap is None or path not in self._checked:
+            key = (path, rect.width(), rect.height())
+            if key not in self._requests:
+                self._requests[key] = QtCore.QPersistentModelIndex(index)
+                # With a cached copy the file is only decoded again if its mtime changed
+                self._loader.request(path, rect.size(), IMAGE_CACHE.mtime(path) if pixmap is not None else None)
+
+        if pixmap is None:
+            # Until it is decoded show the image at the size it was last loaded at, or a placeholder
+            pixmap = IMAGE_CACHE.latest(path)
+            if pixmap is None or pixmap.isNull():
+                painter.fillRect(rect, palette.color(QtGui.QPalette.AlternateBase))
+                return
+            pixmap = pixmap.scaled(rect.size(), QtCore.Qt.KeepAspectRatio, QtCore.Qt.FastTransformation)
+
+        if pixmap.isNull():
+            painter.drawText(rect, QtCore.Qt.AlignCenter, '---')
+        else:
+            _draw_centered(painter, rect, pixmap)
+
+    def _paint_chips(self, painter, rect, tag_records, palette):
+        painter.setFont(self._chip_font)
+        metrics = painter.fontMetrics()
+
+        x, y, row = rect.left(), rect.top(), 0
+        for i, tag_record in enumerate(tag_records):
+            text = tag_record.name or ''
+            width = min(metrics.boundingRect(text).width() + 10, rect.width())
+            if x + width > rect.right() + 1 and x > rect.left():
+                row += 1
+                x, y = rect.left(), y + CHIP_HEIGHT + CHIP_SPACING
+            if row >= CHIP_ROWS:
+                # No room left, show how many tags are hidden
+                more = QtCore.QRect(rect.right() - 30, y - CHIP_HEIGHT - CHIP_SPACING, 31, CHIP_HEIGHT)
+                painter.fillRect(more, palette.color(QtGui.QPalette.Base))
+                painter.setPen(palette.color(QtGui.QPalette.Text))
+                painter.drawText(more, QtCore.Qt.AlignCenter, '+%d' % (len(tag_records) - i))
+                break
+
+            chip = QtCore.QRect(x, y, width, CHIP_HEIGHT)
+            bg_color = QtGui.QColor(tag_record.bg_color) if tag_record.bg_color else palette.color(QtGui.QPalette.Base)
+            fg_color = QtGui.QColor(tag_record.fg_color) if tag_record.fg_color else palette.color(QtGui.QPalette.Text)
+            painter.fillRect(chip, bg_color)
+            painter.setPen(fg_color)
+            painter.drawText(chip, QtCore.Qt.AlignCenter, metrics.elidedText(text, QtCore.Qt.ElideRight, width - 4))
+            x += width + CHIP_SPACING
+
+    def _image_loaded(self, key, image, mtime):
+        self._requests.pop(key, None)
+        self._checked.add(key[0])
+        if image is None:
+            # Unchanged on disk, the cached image stays
+            return
+
+        # Pixmaps can only be created on the GUI thread
+        pixmap = QtGui.QPixmap.fromImage(image) if not image.isNull() else QtGui.QPixmap()
+        IMAGE_CACHE.put(key[0], mtime, QtCore.QSize(key[1], key[2]), pixmap)
+        self.image_ready.emit()
+
+
+def _draw_centered(painter, rect, pixmap):
+    x = rect.left() + (rect.width() - pixmap.width()) // 2
+    y = rect.top() + (rect.height() - pixmap.height()) // 2
+    painter.drawPixmap(x, y, pixmap)
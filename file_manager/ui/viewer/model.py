@@ -0,0 +1,160 @@
+from operator import attrgetter
+
+from Qt import QtCore
+
+from ...config import settings
+from ...data.connection import get_engine
+from ...data.query import Query
+from ...utils import fm_groupby
+
+
+class _AssetItem(object):
+    __slots__ = ('asset', 'tags', 'paths')
+
+    def __init__(self, asset, tags, paths):
+        self.asset = asset
+        self.tags = tags
+        self.paths = paths
+
+
+class AssetModel(QtCore.QAbstractListModel):
+    """
+    Flat list of assets along with their tags and paths.
+
+    Rows are loaded a page at a time through canFetchMore/fetchMore, which the view calls as it is scrolled,
+    either from a query paged by the engine or from a list of already loaded assets.
+    """
+    AssetRole = QtCore.Qt.UserRole + 1
+    TagsRole = QtCore.Qt.UserRole + 2
+    PathsRole = QtCore.Qt.UserRole + 3
+
+    def __init__(self, *args, **kwargs):
+        super(AssetModel, self).__init__(*args, **kwargs)
+
+        self._items = list()  # list[_AssetItem]
+
+        self._query = None
+        self._after = None
+        self._pending_records = list()
+        self._exhausted = True
+
+    def set_assets(self, asset_records):
+        """
+        :type asset_records: list[file_manager.data.entities.asset.AssetEntity]
+        """
+        self._reset()
+        self._pending_records = sorted(asset_records, key=attrgetter('name'))
+        self._exhausted = not self._pending_records
+        self.fetchMore(QtCore.QModelIndex())
+
+    def set_query(self, query):
+        """
+        :type query: file_manager.data.query.Query
+        """
+        self._reset()
+        self._query = query
+        self._exhausted = False
+        self.fetchMore(QtCore.QModelIndex())
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._items)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._items):
+            return None
+
+        item = self._items[index.row()]
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+            return item.asset.name
+        if role == AssetModel.AssetRole:
+            return item.asset
+        if role == AssetModel.TagsRole:
+            return item.tags
+        if role == AssetModel.PathsRole:
+            return item.paths
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent):
+        if parent.isValid() or self._exhausted:
+            return
+
+        page_size = settings.viewer_page_size
+        if self._query is not None:
+            asset_records, self._after = get_engine().select_page(self._query, page_size, after=self._after)
+            self._exhausted = self._after is None
+        else:
+            asset_records = self._pending_records[:page_size]
+            self._pending_records = self._pending_records[page_size:]
+            self._exhausted = not self._pending_records
+
+        if not asset_records:
+            return
+
+        items = self._load_items(asset_records)
+        first = len(self._items)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+        self._items.extend(items)
+        self.endInsertRows()
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self._items[row]
+        self.endRemoveRows()
+
+    def refresh_row(self, row, tags=False):
+        """
+        Repaint a row after its asset changed.
+
+        :type tags: bool
+        :param tags: Reload the tags of the asset from the database as well
+        """
+        item = self._items[row]
+        if tags:
+            engine = get_engine()
+            links = engine.select(Query('tag_to_asset', asset_id=item.asset.id))
+            item.tags = engine.select(Query('tag', id=[_.tag_id for _ in links])) if links else list()
+
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    @staticmethod
+    def _load_items(asset_records):
+        engine = get_engine()
+        asset_ids = [_.id for _ in asset_records]
+
+        # Find tags
+        _links = engine.select(Query('tag_to_asset', asset_id=asset_ids))
+        links_by_asset = dict(fm_groupby(_links, attrgetter('asset_id')))
+        _tags = engine.select(Query('tag', id=list(set(_.tag_id for _ in _links)))) if _links else list()
+        tags_by_id = dict((_.id, _) for _ in _tags)
+
+        # Find paths
+        _paths = engine.select(Query('path', asset_id=asset_ids))
+        paths_by_asset = dict(fm_groupby(_paths, attrgetter('asset_id')))
+
+        items = list()
+        for asset_record in asset_records:
+            links = links_by_asset.get(asset_record.id, list())
+            tags = [tags_by_id[link.tag_id] for link in links if link.tag_id in tags_by_id]
+            paths = paths_by_asset.get(asset_record.id, list())
+            items.append(_AssetItem(asset_record, tags, paths))
+        return items
+
+    def _reset(self):
+        self.beginResetModel()
+        self._items = list()
+        self._query = None
+        self._after = None
+        self._pending_records = list()
+        self._exhausted = True
+        self.endResetModel()
@@ -0,0 +1,261 @@
+from Qt import QtCore, QtGui, QtWidgets
+
+from .delegate import AssetDelegate
+from .model import AssetModel
+from ..image_cache import FRAME_CACHE, pixmap_cost
+from ..image_loader import FrameLoader
+
+
+class AssetListView(QtWidgets.QListView):
+    """
+    Icon mode list of assets, only the visible cells are painted.
+
+    Clicks are mapped onto the regions painted by AssetDelegate and re-emitted as signals with the model index,
+    hovering a gif thumbnail plays it and dragging across it scrubs through the frames. The frames are decoded once
+    in the background at the cell size and kept in FRAME_CACHE, hovering the same asset again plays immediately.
+    """
+    title_double_clicked = QtCore.Signal(object)
+    tags_clicked = QtCore.Signal(object)
+    trash_clicked = QtCore.Signal(object)
+    app_clicked = QtCore.Signal(object, int)
+    app_menu_requested = QtCore.Signal(object, int)
+    thumbnail_menu_requested = QtCore.Signal(object)
+
+    def __init__(self, *args, **kwargs):
+        super(AssetListView, self).__init__(*args, **kwargs)
+
+        self._delegate = AssetDelegate(self)
+        self._hover_index = QtCore.QPersistentModelIndex()
+        self._hover_key = None  # (str, int, int) frames of the hovered gif
+        self._frames = None  # list[(QtGui.QPixmap, int)] frames being played and their delays
+        self._frame_number = 0
+        self._is_scrubbing = False
+
+        # A single thread, only the hovered gif is ever decoded
+        self._frame_loader = FrameLoader(max_threads=1, parent=self)
+        self._frame_loader.image_loaded.connect(self._frames_loaded)
+
+        self._timer_play = QtCore.QTimer(self)
+        self._timer_play.setSingleShot(True)
+        self._timer_play.timeout.connect(self._play)
+
+        self._timer_frame = QtCore.QTimer(self)
+        self._timer_frame.setSingleShot(True)
+        self._timer_frame.timeout.connect(self._next_frame)
+
+        # Pending thumbnail decodes are pruned once scrolling settles
+        self._timer_cancel = QtCore.QTimer(self)
+        self._timer_cancel.setSingleShot(True)
+        self._timer_cancel.setInterval(100)
+        self._timer_cancel.timeout.connect(self._cancel_hidden)
+
+        self.setItemDelegate(self._delegate)
+        self.setViewMode(QtWidgets.QListView.IconMode)
+        self.setMovement(QtWidgets.QListView.Static)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.setBatchSize(500)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.verticalScrollBar().setSingleStep(20)
+        self.setMouseTracking(True)
+        self.setFrameStyle(0)
+
+        self._delegate.image_ready.connect(self.viewport().update)
+        self.verticalScrollBar().valueChanged.connect(self._schedule_cancel)
+
+    def delegate(self):
+        """
+        :rtype: AssetDelegate
+        """
+        return self._delegate
+
+    def setModel(self, model):
+        super(AssetListView, self).setModel(model)
+        model.modelReset.connect(self._schedule_cancel)
+        model.modelReset.connect(self._delegate.revalidate)
+
+    def update_cell_size(self, spacing=10):
+        self.setGridSize(AssetDelegate.cell_size() + QtCore.QSize(spacing, spacing))
+        self._schedule_cancel()
+
+    def mouseMoveEvent(self, evt):
+        if self._is_scrubbing:
+            self._scrub(evt.pos())
+            return
+
+        index, region, _ = self._hit(evt.pos())
+        if region == 'image':
+            if QtCore.QPersistentModelIndex(index) != self._hover_index:
+                self._stop()
+                self._hover_index = QtCore.QPersistentModelIndex(index)
+                self._prepare(index)
+                self._timer_play.start(300)
+        elif self._hover_index.isValid():
+            self._stop()
+
+        super(AssetListView, self).mouseMoveEvent(evt)
+
+    def mousePressEvent(self, evt):
+        if evt.button() == QtCore.Qt.LeftButton and self._frames:
+            index, region, _ = self._hit(evt.pos())
+            if region == 'image' and QtCore.QPersistentModelIndex(index) == self._hover_index:
+                self._is_scrubbing = True
+                self._timer_frame.stop()
+                self._scrub(evt.pos())
+                return
+
+        super(AssetListView, self).mousePressEvent(evt)
+
+    def mouseReleaseEvent(self, evt):
+        if self._is_scrubbing:
+            self._is_scrubbing = False
+            if self._frames:
+                self._timer_frame.start(self._frames[self._frame_number][1])
+            return
+
+        index, region, path_index = self._hit(evt.pos())
+        if evt.button() == QtCore.Qt.RightButton:
+            if region == 'app':
+                self.app_menu_requested.emit(index, path_index)
+            elif region == 'image':
+                self._stop()
+                self.thumbnail_menu_requested.emit(index)
+        elif evt.button() == QtCore.Qt.LeftButton:
+            if region == 'app':
+                self.app_clicked.emit(index, path_index)
+            elif region == 'tags':
+                self.tags_clicked.emit(index)
+            elif region == 'trash':
+                self.trash_clicked.emit(index)
+
+        super(AssetListView, self).mouseReleaseEvent(evt)
+
+    def mouseDoubleClickEvent(self, evt):
+        index, region, _ = self._hit(evt.pos())
+        if region == 'title':
+            self.title_double_clicked.emit(index)
+            return
+        super(AssetListView, self).mouseDoubleClickEvent(evt)
+
+    def leaveEvent(self, evt):
+        self._stop()
+        super(AssetListView, self).leaveEvent(evt)
+
+    def viewportEvent(self, evt):
+        if evt.type() == QtCore.QEvent.ToolTip:
+            index, region, path_index = self._hit(evt.pos())
+            if region == 'app':
+                path_record = index.data(AssetModel.PathsRole)[path_index]
+                QtWidgets.QToolTip.showText(evt.globalPos(), path_record.filepath, self)
+                return True
+        return super(AssetListView, self).viewportEvent(evt)
+
+    def _schedule_cancel(self, *args):
+        self._timer_cancel.start()
+
+    def _cancel_hidden(self):
+        self._delegate.cancel_hidden(self)
+
+    def _hit(self, pos):
+        """
+        :rtype: (QtCore.QModelIndex, str or None, int or None)
+        """
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return index, None, None
+
+        path_records = index.data(AssetModel.PathsRole) or list()
+        region, path_index = AssetDelegate.hit_test(self.visualRect(index), pos, len(path_records))
+        return index, region, path_index
+
+    def _image_rect(self, index):
+        path_records = index.data(AssetModel.PathsRole) or list()
+        return AssetDelegate.regions(self.visualRect(index), len(path_records))['image']
+
+    def _scrub(self, pos):
+        index = QtCore.QModelIndex(self._hover_index)
+        if not index.isValid() or not self._frames:
+            return
+
+        rect = self._image_rect(index)
+        x = min(max(pos.x() - rect.left(), 0), rect.width())
+        frame_count = len(self._frames)
+        self._show_frame(min(int(frame_count * x / float(rect.width())), frame_count - 1))
+
+    def _prepare(self, index):
+        """
+        Start decoding the frames of a hovered gif while the play delay runs.
+        """
+        path = AssetDelegate.thumbnail_path(index.data(AssetModel.AssetRole))
+        if not path or not path.lower().endswith('.gif'):
+            return
+
+        size = self._image_rect(index).size()
+        # Cached frames are only decoded again if the file changed since
+        mtime = FRAME_CACHE.mtime(path) if FRAME_CACHE.get(path, size) is not None else None
+        self._hover_key = self._frame_loader.request(path, size, mtime)
+
+    def _frames_loaded(self, key, frames, mtime):
+        if frames is None:
+            # Unchanged on disk
+            return
+
+        # Pixmaps can only be created on the GUI thread
+        pixmaps = [(QtGui.QPixmap.fromImage(image), delay) for image, delay in frames]
+        FRAME_CACHE.put(key[0], mtime, QtCore.QSize(key[1], key[2]), pixmaps,
+                        cost=sum(pixmap_cost(pixmap) for pixmap, _ in pixmaps))
+
+        if key == self._hover_key and not self._timer_play.isActive():
+            # Hovered long enough already
+            self._play()
+
+    def _play(self):
+        if self._hover_key is None:
+            return
+
+        path, width, height = self._hover_key
+        frames = FRAME_CACHE.get(path, QtCore.QSize(width, height))
+        if not frames:
+            return
+
+        self._frames = frames
+        self._show_frame(0)
+        if not self._is_scrubbing:
+            self._timer_frame.start(frames[0][1])
+
+    def _next_frame(self):
+        if not self._frames:
+            return
+
+        self._show_frame((self._frame_number + 1) % len(self._frames))
+        self._timer_frame.start(self._frames[self._frame_number][1])
+
+    def _show_frame(self, frame_number):
+        self._frame_number = frame_number
+        self._delegate.set_preview(QtCore.QModelIndex(self._hover_index), self._frames[frame_number][0],
+                                   frame_number / float(len(self._frames)))
+        self._update_hovered()
+
+    def _stop(self):
+        self._timer_play.stop()
+        self._timer_frame.stop()
+        self._is_scrubbing = False
+
+        if self._hover_key is not None:
+            # Moving across many gifs only decodes the one the cursor stays on
+            self._frame_loader.cancel(self._hover_key)
+            self._hover_key = None
+
+        if self._frames is not None:
+            self._frames = None
+            self._delegate.set_preview(None, None)
+            self._update_hovered()
+
+        self._hover_index = QtCore.QPersistentModelIndex()
+
+    def _update_hovered(self, *args):
+        index = QtCore.QModelIndex(self._hover_index)
+        if index.isValid():
+            self.viewport().update(self.visualRect(index))
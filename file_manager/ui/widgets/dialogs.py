@@ -16,3 +16,7 @@ def ask(title, question):
     lyt.addWidget(no, 1, 1)
     dlg.setLayout(lyt)
     return dlg.exec_()
+
+
+def show_error(title, message):
+    return QtWidgets.QMessageBox.critical(None, title, message)
@@ -1,10 +1,35 @@
 """
-Example template that imports images that are already suitable for thumbnails
+Example template that renders a turntable gif of each fbx file with mayapy as its thumbnail.
+
+Starting Maya takes longer than most renders, so files are rendered by mayapy processes running
+"fbx_preview.py --worker" that are kept between files. Each process running the template hooks during an import
+keeps FM_FBX_WORKERS of them, the parallelism comes from template_processes in settings.ini. Set FM_MAYAPY to a
+python interpreter and FM_FBX_PREVIEW to maya/fbx_preview_stub.py to try an import without Maya.
 """
+import atexit
 import hashlib
+import json
 import os
 import subprocess
 import tempfile
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+MAYAPY = os.environ.get('FM_MAYAPY', r'C:\Program Files\Autodesk\Maya2018\bin\mayapy.exe')
+PREVIEW_SCRIPT = os.environ.get('FM_FBX_PREVIEW', os.path.join(os.path.dirname(__file__), 'maya', 'fbx_preview.py'))
+WORKERS = int(os.environ.get('FM_FBX_WORKERS', 1))
+STARTUP_TIMEOUT = 300  # Seconds for Maya to start and load the fbx plugin
+RENDER_TIMEOUT = 300  # Seconds for one file, the worker is killed after that
+MAX_JOBS = 50  # Files rendered before a worker is replaced, scenes are never fully released
+CLOSE_TIMEOUT = 10  # Seconds for a worker to exit once its stdin is closed, it is killed after that
+RESPONSE_PREFIX = '@@fm '  # Same as maya/preview_worker.py
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
 
 
 def is_valid(file_path):
@@ -14,17 +39,153 @@ def is_valid(file_path):
 
 def get_thumbnail(file_path):
     tmp = tempfile.gettempdir()
-    dir_path = os.path.dirname(__file__)
-    fbx_prev = os.path.join(dir_path, 'maya', 'fbx_preview.py')
-    gif_path = os.path.join(tmp, hashlib.sha1(file_path).hexdigest(), 'output.gif')
-
-    _args = [
-        r'C:\Program Files\Autodesk\Maya2018\bin\mayapy.exe',
-        fbx_prev,
-        file_path,
-        gif_path,
-    ]
-    _env = os.environ.copy()
-    subprocess.check_output(_args, env=_env)
+    gif_path = os.path.join(tmp, hashlib.sha1(file_path.encode('utf-8')).hexdigest(), 'output.gif')
+
+    _pool().render(file_path, gif_path)
 
     return gif_path
+
+
+class PreviewPool(object):
+    """
+    Thread safe pool of preview worker processes, started when first needed and replaced when they die, time out
+    or reach MAX_JOBS.
+    """
+
+    def __init__(self, command, size=1):
+        """
+        :type command: list[str]
+        :type size: int
+        """
+        self._command = command
+        self._slots = queue.Queue()  # Queue[PreviewWorker or None] idle workers, None for one not started yet
+        for _ in range(max(1, size)):
+            self._slots.put(None)
+
+    def render(self, input_path, output_path, timeout=RENDER_TIMEOUT):
+        """
+        :type input_path: str
+        :type output_path: str
+        :type timeout: float
+        """
+        worker = self._slots.get()
+        try:
+            if worker is not None and (not worker.alive() or worker.jobs >= MAX_JOBS):
+                worker.stop()
+                worker = None
+            if worker is None:
+                worker = PreviewWorker(self._command)
+            worker.render(input_path, output_path, timeout)
+        finally:
+            self._slots.put(worker if worker is not None and worker.alive() else None)
+
+    def close(self):
+        while True:
+            try:
+                worker = self._slots.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+                worker.join(CLOSE_TIMEOUT)
+
+
+class PreviewWorker(object):
+    """
+    One long running preview process, stdout is read on a thread so the pipe never fills up with Maya output.
+    """
+
+    def __init__(self, command, timeout=STARTUP_TIMEOUT):
+        """
+        :type command: list[str]
+        :type timeout: float
+        :param timeout: Seconds to wait for the worker to be ready
+        """
+        self.jobs = 0
+        self._stopped = False
+        self._responses = queue.Queue()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         universal_newlines=True)
+
+        self._reader = threading.Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+        self._wait(timeout)
+
+    def render(self, input_path, output_path, timeout):
+        """
+        :type input_path: str
+        :type output_path: str
+        :type timeout: float
+        """
+        self.jobs += 1
+        job = dict(id=self.jobs, input=input_path, output=output_path)
+        try:
+            self._process.stdin.write(json.dumps(job) + '\n')
+            self._process.stdin.flush()
+        except (IOError, OSError) as e:
+            self.stop(kill=True)
+            raise RuntimeError('Preview worker is gone: %s' % e)
+
+        response = self._wait(timeout)
+        if response.get('error'):
+            raise RuntimeError('Preview of %s failed:\n%s' % (input_path, response['error']))
+
+    def alive(self):
+        return not self._stopped and self._process.poll() is None
+
+    def stop(self, kill=False):
+        """
+        :type kill: bool
+        :param kill: Do not wait for the current render, the worker otherwise exits once it read every job
+        """
+        self._stopped = True
+        try:
+            self._process.stdin.close()
+        except (IOError, OSError):
+            pass
+        if kill and self._process.poll() is None:
+            self._process.kill()
+
+    def join(self, timeout):
+        """
+        Wait for the process to exit after stop, killing it when it takes longer. The reader thread is done once this
+        returns, run from atexit it would otherwise still be reading while the interpreter shuts down.
+
+        :type timeout: float
+        """
+        self._reader.join(timeout)
+        if self._reader.is_alive():
+            self.stop(kill=True)
+            self._reader.join(timeout)
+
+    def _wait(self, timeout):
+        try:
+            response = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            self.stop(kill=True)
+            raise RuntimeError('Preview worker did not answer within %ss.' % timeout)
+
+        if response is None:
+            raise RuntimeError('Preview worker exited with code %s.' % self._process.wait())
+        return response
+
+    def _read(self):
+        for line in iter(self._process.stdout.readline, ''):
+            if line.startswith(RESPONSE_PREFIX):
+                self._responses.put(json.loads(line[len(RESPONSE_PREFIX):]))
+        self._responses.put(None)
+
+
+def _pool():
+    """
+    :rtype: PreviewPool
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = PreviewPool([MAYAPY, PREVIEW_SCRIPT, '--worker'], size=WORKERS)
+                atexit.register(_POOL.close)
+    return _POOL
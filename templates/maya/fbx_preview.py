@@ -1,3 +1,11 @@
+"""
+Renders a turntable gif of an fbx file with mayapy.
+
+    mayapy fbx_preview.py <fbx> <gif>    one file
+    mayapy fbx_preview.py --worker       many files, jobs read from stdin, see preview_worker.py
+
+Starting Maya and loading the fbx plugin takes longer than most renders, worker mode pays for it once.
+"""
 import glob
 import hashlib
 import os
@@ -19,6 +27,8 @@ cmds.loadPlugin("fbxmaya")
 
 import maya.cmds as mc
 
+from preview_worker import serve
+
 
 def convert_skeleton():
     group_name = mc.group(empty=True, name="PrimitiveSkeleton")
@@ -113,7 +123,8 @@ def main(input_name, output_name):
         os.makedirs(output_dir)
 
     # File path setup
-    pb_name = hashlib.sha1(input_name).hexdigest()
+    # Worker jobs come from json as unicode, paths from argv are bytes on python 2
+    pb_name = hashlib.sha1(input_name if isinstance(input_name, bytes) else input_name.encode('utf-8')).hexdigest()
     tmp_path = os.path.join(tempfile.gettempdir(), pb_name)
     if not os.path.isdir(tmp_path):
         os.makedirs(tmp_path)
@@ -172,6 +183,7 @@ def main(input_name, output_name):
     # Convert preview to gif
     _args = [
         os.path.abspath(os.path.join(__file__, '..', 'ffmpeg.exe')),
+        '-nostdin',  # Worker jobs come through stdin
         '-i', final_output,
         '-f', 'gif',
         '-y',
@@ -185,9 +197,27 @@ def main(input_name, output_name):
         os.remove(path)
 
 
-main(sys.argv[1], sys.argv[2])
+def render(input_name, output_name):
+    """
+    Worker job, each file is imported into an empty scene.
+    """
+    if os.path.isfile(output_name):
+        os.remove(output_name)
 
-try:
-    maya.standalone.uninitialize(name='python')
-except RuntimeError:
-    pass
+    cmds.file(new=True, force=True)
+    main(input_name, output_name)
+
+    if not os.path.isfile(output_name):
+        raise RuntimeError('No preview written for %s' % input_name)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--worker']:
+        serve(render)
+    else:
+        main(sys.argv[1], sys.argv[2])
+
+    try:
+        maya.standalone.uninitialize(name='python')
+    except RuntimeError:
+        pass
@@ -0,0 +1,34 @@
+"""
+Stand-in for "fbx_preview.py --worker" that needs no Maya, it answers every job with a placeholder gif. Run the fbx
+template with FM_MAYAPY set to a python interpreter and FM_FBX_PREVIEW set to this file to try an import without
+Maya. FM_STUB_STARTUP and FM_STUB_RENDER are the seconds startup and each render pretend to take.
+"""
+import base64
+import os
+import time
+
+from preview_worker import serve
+
+STARTUP_SECONDS = float(os.environ.get('FM_STUB_STARTUP', 0))
+RENDER_SECONDS = float(os.environ.get('FM_STUB_RENDER', 0))
+
+# Single black pixel
+_GIF = base64.b64decode('R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7')
+
+
+def render(input_name, output_name):
+    if not os.path.isfile(input_name):
+        raise IOError('File does not exist %s' % input_name)
+
+    time.sleep(RENDER_SECONDS)
+
+    output_dir = os.path.dirname(output_name)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(output_name, 'wb') as f:
+        f.write(_GIF)
+
+
+if __name__ == '__main__':
+    time.sleep(STARTUP_SECONDS)
+    serve(render)
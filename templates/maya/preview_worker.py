@@ -0,0 +1,48 @@
+"""
+Line based protocol between templates/fbx.py and the preview processes it keeps running, free of Maya imports so
+the stub worker speaks it too.
+
+Each job is one JSON line on stdin with an id, an input and an output path, answered by one line on stdout starting
+with RESPONSE_PREFIX. Anything else written to stdout, Maya prints plenty, is ignored by the template. A first answer
+without an id tells the template the worker finished starting up. The worker exits once stdin is closed.
+"""
+import json
+import sys
+import traceback
+
+RESPONSE_PREFIX = '@@fm '
+
+
+def serve(render, stdin=None, stdout=None):
+    """
+    :type render: callable
+    :param render: Called with the input and output path of each job, raises when no preview could be made
+    :type stdin: file
+    :type stdout: file
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    respond(stdout, dict(ready=True))
+    for line in iter(stdin.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+
+        job = dict()
+        try:
+            job = json.loads(line)
+            render(job['input'], job['output'])
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+        respond(stdout, dict(id=job.get('id'), output=job.get('output'), error=error))
+
+
+def respond(stdout, data):
+    """
+    :type stdout: file
+    :type data: dict
+    """
+    stdout.write(RESPONSE_PREFIX + json.dumps(data) + '\n')
+    stdout.flush()